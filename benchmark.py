@@ -0,0 +1,531 @@
+"""
+benchmark.py: performance benchmarks for the Wordie framework
+
+Usage:
+    python benchmark.py generate corpus/ --meetings 100 --speakers 8 --minutes 60
+    python benchmark.py stages --meetings 20 --speakers 5 --minutes 90 --out bench_output.json
+    python benchmark.py sankey --links 10000 50000
+    python benchmark.py startup --budget 0.5
+    python benchmark.py stream --minutes 60 600 3000
+    python benchmark.py tokenizer --target 2000000
+    python benchmark.py snapshot --meetings 200
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from ngrams import ngram_counts
+from sankey import make_sankey
+from sentiment import SentimentProfile, get_engine
+from tokenizer import get_tokenizer
+from transcripts import ZoomTranscript
+from wordie import PARSER_VERSION, PUNCTUATION
+
+FIRST_NAMES = ['John', 'Kate', 'Sarah', 'Kalden', 'Lon', 'Natalie', 'Victor', 'Maria', 'Wei', 'Amir',
+               'Priya', 'Diego', 'Hana', 'Omar', 'Lucia', 'Tom', 'Grace', 'Ivan', 'Zoe', 'Sam']
+LAST_NAMES = ['Rachlin', 'Lanman', 'Bernardo', 'Harp', 'Pierson', 'Hammel', 'Chen', 'Garcia', 'Smith', 'Khan']
+
+# common spoken words (some of them in the VADER lexicon), drawn with a Zipf-like distribution
+VOCABULARY = """the and to of a i that you it is in we this so what be just have but do not for on with
+can data like know right going let's want if here think at all one okay yeah now see about your there
+function test python class they are was will would get make code file time good great nice bad wrong
+problem love hard easy interesting sure maybe well really question database table query model value
+list dictionary string number plot chart library object method don't it's that's we're you're""".split()
+
+
+def timed(fn, *args, repeat=3, **kwargs):
+    """
+    Time a function call
+    :param fn: function to time
+    :param repeat: int; number of runs, the fastest is reported
+    :return: (best wall time in seconds, result of the last call)
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def speaker_names(n_speakers):
+    """
+    :param n_speakers: int; number of speakers
+    :return: list of distinct, capitalized speaker names
+    """
+    return [f'{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]}'
+            + (f' {i // (len(FIRST_NAMES) * len(LAST_NAMES))}' if i >= len(FIRST_NAMES) * len(LAST_NAMES) else '')
+            for i in range(n_speakers)]
+
+
+def generate_transcript(filename, n_speakers=5, minutes=60, seed=0, words_per_minute=150, delimiter='user avatar'):
+    """
+    Write a synthetic transcript in Zoom's format: speaker name and HH:MM:SS timestamp lines
+    before each turn, and the delimiter line between turns. The first speaker is the host
+    and talks most of the time
+    :param filename: str; file to write
+    :param n_speakers: int; number of speakers
+    :param minutes: float; length of the meeting
+    :param seed: int; random seed
+    :param words_per_minute: int; speaking rate
+    :param delimiter: str; line separating turns
+    :return: int; number of words written
+    """
+    rng = np.random.default_rng(seed)
+    names = speaker_names(n_speakers)
+
+    # the host speaks about half of the turns, the others share the rest
+    weights = np.full(n_speakers, 1.0 / max(n_speakers - 1, 1) / 2) if n_speakers > 1 else np.ones(1)
+    weights[0] = 0.5 if n_speakers > 1 else 1.0
+    word_p = 1.0 / np.arange(1, len(VOCABULARY) + 1)
+    word_p /= word_p.sum()
+
+    seconds, total_words = 0.0, 0
+    with open(filename, 'w') as f:
+        first = True
+        while seconds < minutes * 60:
+            speaker = rng.choice(n_speakers, p=weights)
+
+            # the host talks in long turns, everyone else in short interjections
+            n_words = int(rng.integers(40, 400) if speaker == 0 else rng.integers(1, 40))
+            words = np.array(VOCABULARY)[rng.choice(len(VOCABULARY), n_words, p=word_p)]
+
+            # cut the words into sentences of 3 to 20 words, and the sentences into lines
+            lines, i = [], 0
+            while i < n_words:
+                length = int(rng.integers(3, 21))
+                lines.append(' '.join(words[i:i + length]).capitalize() + '.')
+                i += length
+
+            if not first:
+                f.write(delimiter + '\n')
+            first = False
+
+            timestamp = int(seconds)
+            f.write(f'{names[speaker]}\n{timestamp // 3600:02d}:{timestamp // 60 % 60:02d}:{timestamp % 60:02d}\n')
+            f.write('\n'.join(lines) + '\n')
+
+            seconds += n_words / words_per_minute * 60 + rng.exponential(2)
+            total_words += n_words
+
+    return total_words
+
+
+def generate_corpus(outdir, n_meetings=10, n_speakers=5, minutes=60, seed=0):
+    """
+    Write a directory of synthetic transcripts
+    :param outdir: str; output directory (created if missing)
+    :param n_meetings: int; number of transcripts
+    :param n_speakers: int; speakers per meeting
+    :param minutes: float; length of each meeting
+    :param seed: int; random seed
+    :return: list of file names
+    """
+    os.makedirs(outdir, exist_ok=True)
+    width = len(str(n_meetings))
+
+    filenames = []
+    for i in range(n_meetings):
+        filenames.append(os.path.join(outdir, f'meeting-{i:0{width}d}.txt'))
+        generate_transcript(filenames[-1], n_speakers, minutes, seed + i)
+    return filenames
+
+
+def bench_stages(filenames, speaker=None):
+    """
+    Time each stage of loading and charting a corpus. Every stage is timed over the whole corpus
+    :param filenames: list of transcripts
+    :param speaker: str; speaker to load (default the first, most talkative, synthetic speaker)
+    :return: list of result records
+    """
+    speaker = speaker or speaker_names(1)[0]
+    corpus = ZoomTranscript()
+    tokenizer = get_tokenizer()
+    engine = get_engine()
+
+    # make sure one-off setup (lexicon, stop word corpus) is not timed as part of a stage
+    engine.profile(['warm up'])
+
+    # the stages of Wordie._text_results, in its order
+    seconds = dict.fromkeys(['transcript_reader', 'tokenize', 'sentiment', 'phrases', 'sentences',
+                             '_save_results'], 0.0)
+    tokens = 0
+
+    for filename in filenames:
+        start = time.perf_counter()
+        text = corpus.transcript_reader(filename, speaker)
+        seconds['transcript_reader'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        plain, sentences, numtokens, words, wordcount = tokenizer.tokenize(text)
+        seconds['tokenize'] += time.perf_counter() - start
+        tokens += numtokens
+
+        # both passes: each sentence for the profile, and the whole text for the document sentiment
+        start = time.perf_counter()
+        engine.profile(sentences)
+        engine.polarity_scores(plain)
+        seconds['sentiment'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        ngram_counts(words)
+        seconds['phrases'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        np.bincount(corpus.sen_len(sentences)).astype(np.int32)
+        seconds['sentences'] += time.perf_counter() - start
+
+        results = corpus._text_results(text)
+        start = time.perf_counter()
+        corpus._save_results(filename, results)
+        seconds['_save_results'] += time.perf_counter() - start
+
+    records = [{'benchmark': 'stage', 'stage': stage, 'files': len(filenames), 'tokens': tokens,
+                'seconds': value} for stage, value in seconds.items()]
+
+    for chart in ['wordcount_sankey', 'sent_over_time', 'pie_chart', 'subplot_bar']:
+        value, _ = timed(getattr(corpus, chart), show=False, repeat=1)
+        records.append({'benchmark': 'chart', 'stage': chart, 'files': len(filenames), 'seconds': value})
+
+    return records
+
+
+def environment():
+    """
+    :return: dict describing the code and machine the benchmark ran on
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'commit': commit, 'parser_version': PARSER_VERSION, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def bench_sankey(n_links=10000, n_targets=100, seed=0):
+    """
+    Time make_sankey on a frame with n_links (document, word, count) rows,
+    both as pre-aggregated links and as a three column chain aggregated by make_sankey
+    :param n_links: int; number of rows in the input frame
+    :param n_targets: int; number of distinct words
+    :param seed: int; random seed
+    :return: list of result records
+    """
+    rng = np.random.default_rng(seed)
+    n_sources = max(n_links // n_targets, 1)
+    df = pd.DataFrame({
+        'src': np.repeat([f'meeting {i}' for i in range(n_sources)], n_targets)[:n_links],
+        'targ': np.tile([f'word{i}' for i in range(n_targets)], n_sources)[:n_links],
+        'speaker': rng.choice([f'speaker {i}' for i in range(20)], n_links),
+        'vals': rng.integers(1, 100, n_links)
+    })
+
+    records = []
+    seconds, fig = timed(make_sankey, df, ['src', 'targ'], vals='vals', threshold=0, prep=False)
+    records.append({'benchmark': 'sankey_links', 'links': n_links,
+                    'rendered_links': len(fig.data[0].link.source), 'seconds': seconds})
+
+    seconds, fig = timed(make_sankey, df, ['src', 'speaker', 'targ'], threshold=0)
+    records.append({'benchmark': 'sankey_chain', 'links': n_links,
+                    'rendered_links': len(fig.data[0].link.source), 'seconds': seconds})
+    return records
+
+
+def bench_stream(minutes=(150, 600), n_speakers=5, seed=0):
+    """
+    Compare peak memory and time of parsing transcripts of growing length in memory and streamed,
+    and check that both give the same results
+    :param minutes: lengths of the synthetic transcripts (streaming reads 64K characters at a time,
+                    so transcripts shorter than that, about 100 minutes, need less memory)
+    :param n_speakers: int; speakers in each transcript
+    :param seed: int; random seed
+    :return: list of result records; the stream records hold their peak memory over that of the shortest
+             transcript as peak_growth
+    """
+    corpus = ZoomTranscript()
+    get_engine().profile(['warm up'])
+    corpus.load_stop_words()
+
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for length in minutes:
+            filename = os.path.join(tmp, f'meeting-{length}.txt')
+            generate_transcript(filename, n_speakers, length, seed)
+
+            results = {}
+            for mode, stream in [('memory', False), ('stream', True)]:
+                tracemalloc.start()
+                start = time.perf_counter()
+                results[mode] = corpus._default_parser(filename, stream=stream)
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                records.append({'benchmark': 'stream', 'mode': mode, 'minutes': length,
+                                'bytes': os.path.getsize(filename), 'seconds': seconds, 'peak_memory': peak})
+
+            # streaming keeps neither the plain text nor the sentence lengths, and past their bounds it prunes
+            # the phrase counts and merges sentences of the sentiment profile; everything else must match
+            memory, streamed = results['memory'], results['stream']
+            skipped = ('plain_text', 'sentence_length', 'phrases', 'sentiment_profile', 'turn_sentiment')
+            same = all(k in streamed and (np.array_equal(memory[k], streamed[k], equal_nan=True)
+                                          if isinstance(memory[k], np.ndarray) or isinstance(streamed[k], np.ndarray)
+                                          else memory[k] == streamed[k])
+                       for k in memory if k not in skipped)
+            for record in records[-2:]:
+                record['identical'] = same
+                record['phrases_identical'] = memory['phrases'] == streamed['phrases']
+
+    shortest = min((r for r in records if r['mode'] == 'stream'), key=lambda r: r['bytes'])
+    for record in records:
+        if record['mode'] == 'stream':
+            record['peak_growth'] = record['peak_memory'] / shortest['peak_memory']
+    return records
+
+
+def bench_tokenizer(filenames, repeat=3):
+    """
+    Tokens per second (on one core) of splitting and stop word filtering, with Tokenizer.tokenize (the path
+    of the default parsers) and with the word by word list lookup of Wordie.del_stopwords, and whether both
+    give the same words
+    :param filenames: list of transcripts
+    :param repeat: int; number of runs, the fastest is reported
+    :return: list of result records
+    """
+    texts = [ZoomTranscript.transcript_reader(filename) for filename in filenames]
+    stopwords = ZoomTranscript.load_stop_words()
+    tokenizer = get_tokenizer()
+
+    def listed():
+        out = []
+        for text in texts:
+            text.split('.')
+            out.append(ZoomTranscript.del_stopwords(text.translate(PUNCTUATION).split(), stopwords))
+        return out
+
+    def tokenized():
+        return [tokenizer.tokenize(text)[3] for text in texts]
+
+    tokens = sum(len(text.translate(PUNCTUATION).split()) for text in texts)
+    records = []
+    for name, fn in [('del_stopwords', listed), ('tokenizer', tokenized)]:
+        seconds, words = timed(fn, repeat=repeat)
+        records.append({'benchmark': 'tokenizer', 'engine': name, 'files': len(filenames), 'tokens': tokens,
+                        'seconds': seconds, 'tokens_per_second': tokens / seconds})
+
+    same = listed() == tokenized()
+    for record in records:
+        record['identical'] = same
+    return records
+
+
+def same_value(a, b):
+    """ whether two stored statistics are equal (arrays compare NaN equal) """
+    if isinstance(a, SentimentProfile) or isinstance(b, SentimentProfile):
+        return same_value(a.tokens, b.tokens) and same_value(a.weighted, b.weighted)
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(np.asarray(a), np.asarray(b), equal_nan=True)
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_value(a[k], b[k]) for k in a)
+    return a == b
+
+
+def same_corpus(a, b):
+    """ whether two corpora hold the same documents and statistics """
+    return (list(a.records) == list(b.records) and sorted(a.data) == sorted(b.data)
+            and all(a.data[stat].keys() == b.data[stat].keys()
+                    and all(same_value(a.data[stat][label], b.data[stat][label]) for label in a.data[stat])
+                    for stat in a.data))
+
+
+def bench_snapshot(filenames):
+    """
+    Time saving and reopening a snapshot, and check that it round-trips, including saving a reopened
+    corpus over its own snapshot (whose columns it still has memory-mapped)
+    :param filenames: list of transcripts
+    :return: list of result records
+    """
+    corpus = ZoomTranscript()
+    corpus.load_texts(filenames, workers=1)
+
+    with tempfile.TemporaryDirectory() as path:
+        save_seconds, _ = timed(corpus.save, path, repeat=1)
+        load_seconds, reopened = timed(ZoomTranscript.load, path, repeat=1)
+        identical = same_corpus(corpus, reopened)
+
+        # change the reopened corpus and save it in place, while its columns are still mapped
+        corpus.remove_text(filenames[0])
+        reopened.remove_text(filenames[0])
+        reopened.save(path)
+        in_place = same_corpus(corpus, reopened) and same_corpus(corpus, ZoomTranscript.load(path))
+
+    return [{'benchmark': 'snapshot', 'files': len(filenames), 'save_seconds': save_seconds,
+             'load_seconds': load_seconds, 'identical': identical, 'resave_identical': in_place}]
+
+
+# modules that must not be imported just by importing the framework
+LAZY_MODULES = ['plotly', 'pandas', 'nltk', 'scipy']
+
+
+def bench_startup(modules=('wordie', 'transcripts', 'sankey'), repeat=5):
+    """
+    Time importing the framework in a fresh interpreter, and check which heavy dependencies it loaded
+    :param modules: modules to import
+    :param repeat: int; number of fresh interpreters, the fastest is reported
+    :return: list with one result record
+    """
+    code = ('import sys, time, json; start = time.perf_counter(); import ' + ', '.join(modules) +
+            '; print(json.dumps([time.perf_counter() - start, [m for m in %r if m in sys.modules]]))' % LAZY_MODULES)
+
+    best, loaded = float('inf'), []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        seconds, loaded = json.loads(out)
+        best = min(best, seconds)
+
+    return [{'benchmark': 'startup', 'modules': list(modules), 'seconds': best, 'eager_imports': loaded}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wordie performance benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def corpus_args(command):
+        command.add_argument('--meetings', type=int, default=10, help='number of meetings (1 to 100k)')
+        command.add_argument('--speakers', type=int, default=5, help='speakers per meeting (1 to 50)')
+        command.add_argument('--minutes', type=float, default=60, help='length of each meeting')
+        command.add_argument('--seed', type=int, default=0)
+
+    generate = sub.add_parser('generate', help='write synthetic Zoom transcripts')
+    generate.add_argument('outdir')
+    corpus_args(generate)
+
+    stages = sub.add_parser('stages', help='time each loading stage and chart on a synthetic corpus')
+    stages.add_argument('--corpus', help='existing directory of transcripts (default: generate one)')
+    stages.add_argument('--speaker', help='speaker to load from an existing corpus')
+    corpus_args(stages)
+
+    sankey = sub.add_parser('sankey', help='time make_sankey on synthetic links')
+    sankey.add_argument('--links', type=int, nargs='+', default=[10000])
+
+    startup = sub.add_parser('startup', help='time importing the framework; fails if over budget')
+    startup.add_argument('--budget', type=float, default=0.5, help='maximum import time in seconds')
+
+    stream = sub.add_parser('stream', help='compare peak memory of in-memory and streamed parsing; fails if the '
+                                           'streamed peak grows with the transcript')
+    stream.add_argument('--minutes', type=float, nargs='+', default=[150, 600], help='transcript lengths')
+    stream.add_argument('--speakers', type=int, default=5)
+    stream.add_argument('--growth', type=float, default=1.25,
+                        help='most the streamed peak memory may grow over that of the shortest transcript')
+
+    tokens = sub.add_parser('tokenizer', help='measure tokenizer throughput; fails if under target')
+    tokens.add_argument('--corpus', help='existing directory of transcripts (default: generate one)')
+    tokens.add_argument('--target', type=float, default=2e6, help='minimum tokens per second per core')
+    corpus_args(tokens)
+
+    snapshot = sub.add_parser('snapshot', help='time saving and reopening a snapshot; fails if it does not '
+                                               'round-trip')
+    snapshot.add_argument('--corpus', help='existing directory of transcripts (default: generate one)')
+    corpus_args(snapshot)
+
+    for command in (stages, sankey, startup, stream, tokens, snapshot):
+        command.add_argument('--out', help='json file to write results to (default: print them)')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        filenames = generate_corpus(args.outdir, args.meetings, args.speakers, args.minutes, args.seed)
+        print(f'wrote {len(filenames)} transcripts to {args.outdir}')
+        return
+
+    records = []
+    if args.command == 'stages':
+        if args.corpus:
+            records += bench_stages(ZoomTranscript._expand_paths(args.corpus), args.speaker)
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                filenames = generate_corpus(tmp, args.meetings, args.speakers, args.minutes, args.seed)
+                records += bench_stages(filenames)
+            for record in records:
+                record.update(meetings=args.meetings, speakers=args.speakers, minutes=args.minutes)
+
+    elif args.command == 'sankey':
+        for n_links in args.links:
+            records += bench_sankey(n_links)
+
+    elif args.command == 'startup':
+        records += bench_startup()
+
+    elif args.command == 'stream':
+        records += bench_stream(args.minutes, args.speakers)
+
+    elif args.command == 'tokenizer':
+        if args.corpus:
+            records += bench_tokenizer(ZoomTranscript._expand_paths(args.corpus))
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                records += bench_tokenizer(generate_corpus(tmp, args.meetings, args.speakers, args.minutes,
+                                                           args.seed))
+
+    elif args.command == 'snapshot':
+        if args.corpus:
+            records += bench_snapshot(ZoomTranscript._expand_paths(args.corpus))
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                records += bench_snapshot(generate_corpus(tmp, args.meetings, args.speakers, args.minutes,
+                                                          args.seed))
+
+    output = json.dumps({'environment': environment(), 'results': records}, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    # the startup budget is enforced: a slow or eager import exits with an error
+    if args.command == 'startup':
+        over = [r for r in records if r['seconds'] > args.budget or r['eager_imports']]
+        for record in over:
+            print(f"startup {record['seconds']:.3f}s (budget {args.budget}s), "
+                  f"eagerly imported: {', '.join(record['eager_imports']) or 'nothing'}", file=sys.stderr)
+        if over:
+            sys.exit(1)
+
+    # so is the tokenizer throughput target, and equal output to the word by word filter
+    if args.command == 'tokenizer':
+        engine = next(r for r in records if r['engine'] == 'tokenizer')
+        if engine['tokens_per_second'] < args.target or not engine['identical']:
+            print(f"tokenizer {engine['tokens_per_second']:,.0f} tokens/s (target {args.target:,.0f}), "
+                  f"identical output: {engine['identical']}", file=sys.stderr)
+            sys.exit(1)
+
+    # streaming has to keep memory flat as transcripts grow, with the results of the in-memory parser
+    if args.command == 'stream':
+        failed = [r for r in records if r['mode'] == 'stream' and (r['peak_growth'] > args.growth
+                                                                   or not r['identical'])]
+        for record in failed:
+            print(f"stream {record['minutes']} minutes: peak memory x{record['peak_growth']:.2f} of the shortest "
+                  f"transcript (at most x{args.growth}), identical results: {record['identical']}",
+                  file=sys.stderr)
+        if failed:
+            sys.exit(1)
+
+    # and a snapshot that does not reopen (or save in place) to the same corpus
+    if args.command == 'snapshot' and not all(r['identical'] and r['resave_identical'] for r in records):
+        print('snapshot does not round-trip', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
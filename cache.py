@@ -0,0 +1,157 @@
+"""
+cache.py: content-addressed on-disk cache for parser results
+
+Entries are keyed by the hash of the file's contents plus the parameters the
+parser was called with, so an unchanged file parsed the same way is never parsed twice.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """
+    Hash the contents of a file
+    :param filename: str; file to hash
+    :param chunk_size: int; number of bytes read at a time
+    :return: str; hex sha256 digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    Size-bounded, least recently used cache of parser results stored as pickles in a directory
+    """
+
+    def __init__(self, directory='.wordie_cache', max_bytes=256 * 2 ** 20):
+        """
+        :param directory: str; folder holding the cache entries (created if missing)
+        :param max_bytes: int; total size the cache may grow to before old entries are evicted
+                          (down to nine tenths of it)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # running total of the entry sizes, so an insert only scans the directory once the cache is full
+        # (None until the first insert; other processes writing to the directory are caught up at eviction)
+        self._total = None
+
+    @staticmethod
+    def key(filename, params):
+        """
+        Build the cache key for a file parsed with the given parameters
+        :param filename: str; file being parsed
+        :param params: dict; everything that changes the parser output (must be json serializable)
+        :return: str; key of the form <content hash>-<parameter hash>
+        """
+        param_hash = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        return f'{file_digest(filename)}-{param_hash[:16]}'
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """
+        Look up a cached result, marking it as recently used
+        :param key: str; cache key
+        :return: the cached results dict, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                results = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # bump the modification time; eviction removes the oldest entries first
+        os.utime(path)
+        return results
+
+    def put(self, key, results):
+        """
+        Store a result in the cache, evicting least recently used entries if it grew too large
+        :param key: str; cache key
+        :param results: results dict to store
+        :return: none
+        """
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._entries())
+
+        # write to a temporary file first so readers never see a partial entry
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+
+        self._total += size - replaced
+        if self._total > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        """ list of (last used, size, path) for every entry in the cache """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """ remove the least recently used entries until the cache fits in max_bytes """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            self._total = total
+            return
+
+        # free a tenth of the cache at once, so a full cache is not scanned again on every insert
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self._total = total
+
+    def invalidate(self, filename=None):
+        """
+        Drop cache entries
+        :param filename: str; drop only the entries for this file's current contents (default: drop everything)
+        :return: int; number of entries removed
+        """
+        prefix = file_digest(filename) + '-' if filename is not None else ''
+
+        removed = 0
+        for _, _, path in self._entries():
+            if os.path.basename(path).startswith(prefix):
+                os.remove(path)
+                removed += 1
+
+        # recounted on the next insert
+        self._total = None
+        return removed
+
+    def size(self):
+        """
+        :return: int; total number of bytes stored in the cache
+        """
+        return sum(size for _, size, _ in self._entries())
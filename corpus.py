@@ -0,0 +1,200 @@
+"""
+corpus.py: corpus-wide word statistics maintained alongside Wordie's per-document data
+"""
+
+from collections import Counter
+from collections.abc import MutableMapping
+import heapq
+from operator import itemgetter
+import numpy as np
+
+
+class CorpusIndex:
+    """
+    Word frequencies summed over every document, updated incrementally as documents are added or removed
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, wordcount):
+        """
+        Add a document's word counts to the corpus totals
+        :param wordcount: dict {word: count} of the document
+        :return: none
+        """
+        self.counts.update(wordcount)
+
+    def remove(self, wordcount):
+        """
+        Take a document's word counts out of the corpus totals
+        :param wordcount: dict {word: count} of the document
+        :return: none
+        """
+        for word, count in wordcount.items():
+            remaining = self.counts[word] - count
+            if remaining > 0:
+                self.counts[word] = remaining
+            else:
+                del self.counts[word]
+
+    def top_k(self, k=5):
+        """
+        Most frequent words across the corpus
+        :param k: int; number of words
+        :return: list of (word, count), most frequent first
+        """
+        return heapq.nlargest(k, self.counts.items(), key=itemgetter(1))
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class DocTermMatrix:
+    """
+    Columnar storage of every document's word counts: a shared vocabulary mapping each word
+    to an integer id, and one row of (ids, counts) arrays per document, assembled into a
+    SciPy sparse document-term matrix when needed
+    """
+
+    def __init__(self):
+        self.vocab = {}
+        self.words = []
+        self.totals = np.zeros(0, dtype=np.int64)
+        self._rows = {}
+        self._matrix = None
+
+    def encode(self, words, grow=True):
+        """
+        Look up the integer ids of words
+        :param words: iterable of words
+        :param grow: bool; add unseen words to the vocabulary (otherwise they get id -1)
+        :return: array of ids
+        """
+        if grow:
+            for word in words:
+                if word not in self.vocab:
+                    self.vocab[word] = len(self.words)
+                    self.words.append(word)
+            if len(self.totals) < len(self.words):
+                self.totals = np.concatenate([self.totals, np.zeros(len(self.words) - len(self.totals), np.int64)])
+
+        return np.array([self.vocab.get(word, -1) for word in words], dtype=np.int64)
+
+    def set_row(self, label, wordcount):
+        """
+        Store (or replace) a document's word counts
+        :param label: label of the document
+        :param wordcount: dict {word: count}
+        :return: none
+        """
+        if label in self._rows:
+            self.remove(label)
+
+        ids = self.encode(list(wordcount)).astype(np.int32)
+        counts = np.fromiter(wordcount.values(), dtype=np.int32, count=len(ids))
+        np.add.at(self.totals, ids, counts)
+
+        self._rows[label] = (ids, counts)
+        self._matrix = None
+
+    def remove(self, label):
+        """
+        Remove a document's row
+        :param label: label of the document
+        :return: none
+        """
+        ids, counts = self._rows.pop(label)
+        np.subtract.at(self.totals, ids, counts)
+        self._matrix = None
+
+    def row(self, label):
+        """
+        :param label: label of the document
+        :return: Counter {word: count} of the document
+        """
+        ids, counts = self._rows[label]
+        return Counter(dict(zip([self.words[i] for i in ids], counts.tolist())))
+
+    @property
+    def labels(self):
+        return list(self._rows)
+
+    def matrix(self):
+        """
+        :return: scipy.sparse CSR matrix, one row per document (in label order) and one column per word id
+        """
+        if self._matrix is None:
+            from scipy import sparse
+
+            rows = list(self._rows.values())
+            indptr = np.concatenate([[0], np.cumsum([len(ids) for ids, _ in rows])])
+            indices = np.concatenate([ids for ids, _ in rows]) if rows else np.zeros(0, np.int32)
+            data = np.concatenate([counts for _, counts in rows]) if rows else np.zeros(0, np.int32)
+            self._matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(rows), len(self.words)))
+
+        return self._matrix
+
+    def top_k(self, k=5):
+        """
+        Most frequent words across the corpus
+        :param k: int; number of words
+        :return: list of (word, count), most frequent first
+        """
+        k = min(k, len(self.totals))
+        top = np.argpartition(-self.totals, k - 1)[:k] if k else np.zeros(0, np.int64)
+
+        # order the k winners by count, ties broken by first appearance in the vocabulary
+        top = top[np.lexsort((top, -self.totals[top]))]
+        return [(self.words[i], int(self.totals[i])) for i in top if self.totals[i] > 0]
+
+    def filter(self, words):
+        """
+        Counts of the given words in every document
+        :param words: list of words
+        :return: (list of labels, array of counts with one row per label and one column per word)
+        """
+        ids = self.encode(words, grow=False)
+        if not self.words:
+            return self.labels, np.zeros((len(self.labels), len(words)), dtype=np.int64)
+        counts = self.matrix()[:, np.maximum(ids, 0)].toarray()
+
+        # words outside the vocabulary never occur
+        counts[:, ids < 0] = 0
+        return self.labels, counts
+
+    def view(self):
+        """
+        :return: WordcountView exposing the matrix like data['wordcount'] of the dict backend
+        """
+        return WordcountView(self)
+
+    def __len__(self):
+        return len(self.words)
+
+
+class WordcountView(MutableMapping):
+    """
+    {label: Counter} view over a DocTermMatrix; rows are decoded on access
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __getitem__(self, label):
+        return self.matrix.row(label)
+
+    def __setitem__(self, label, wordcount):
+        self.matrix.set_row(label, wordcount)
+
+    def __delitem__(self, label):
+        self.matrix.remove(label)
+
+    def __contains__(self, label):
+        return label in self.matrix._rows
+
+    def __iter__(self):
+        return iter(self.matrix.labels)
+
+    def __len__(self):
+        return len(self.matrix._rows)
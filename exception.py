@@ -13,11 +13,27 @@ class WordieError(Exception):
         :param filename:
         :return:
         """
-        try:
-            assert (filename[-4:] == '.txt'), 'Need a txt file to run the parser'
+        from validation import check_file
 
-            text = open(filename).read().lower()
-            assert text != '', 'File is empty!'
+        # the file's stat is enough: no need to read it
+        check_file(filename)
 
-        finally:
-            pass
+
+class InvalidFile(WordieError):
+    """
+    A file that failed a pre-flight check
+    """
+
+    def __init__(self, filename, check, reason):
+        """
+        :param filename: str; name of the file
+        :param check: str; name of the check that failed
+        :param reason: str; why the file was rejected
+        """
+        Exception.__init__(self, filename, check, reason)
+        self.filename = filename
+        self.check = check
+        self.reason = reason
+
+    def __str__(self):
+        return f'{self.filename}: {self.reason}'
@@ -0,0 +1,112 @@
+"""
+export.py: headless, parallel export of plotly figures to files
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import warnings
+
+MANIFEST = '.export_manifest.json'
+
+
+def _filename(name):
+    """ turn a figure name into a safe file name (without extension) """
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'figure'
+
+
+def _write_figure(fig_json, base, formats):
+    """
+    Write one figure in every requested format
+    :param fig_json: str; the figure as plotly json
+    :param base: str; output path without extension
+    :param formats: list of file formats
+    :return: list of written paths
+    """
+    import plotly.io as pio
+
+    fig = pio.from_json(fig_json, skip_invalid=True)
+    written = []
+    for fmt in formats:
+        path = f'{base}.{fmt}'
+        if fmt == 'json':
+            with open(path, 'w') as f:
+                f.write(fig_json)
+        elif fmt == 'html':
+            fig.write_html(path, include_plotlyjs='cdn')
+        else:
+            fig.write_image(path)
+        written.append(path)
+    return written
+
+
+def export_figures(figures, outdir, formats=('html', 'json'), workers=None, force=False, digests=None):
+    """
+    Write figures to an output directory in parallel. A manifest in outdir records a hash of
+    each figure, and figures whose content is unchanged since the last export are skipped
+    :param figures: dict {figure name: figure, or function without arguments building it}
+    :param outdir: str; output directory (created if missing)
+    :param formats: list of file formats: 'html', 'json' and, if kaleido is installed, image formats such as 'png'
+    :param workers: int; number of worker processes (1 writes in-process)
+    :param force: bool; rewrite every figure
+    :param digests: optional dict {figure name: hash of what the figure is drawn from}; a figure with a
+                    digest is only built if the digest changed, others are built and their content hashed
+    :return: dict {figure name: 'written' or 'unchanged'}
+    """
+    os.makedirs(outdir, exist_ok=True)
+
+    # static images need kaleido; skip them rather than failing the whole export
+    formats = list(formats)
+    images = [fmt for fmt in formats if fmt not in ('html', 'json')]
+    if images and importlib.util.find_spec('kaleido') is None:
+        warnings.warn(f'kaleido is not installed, skipping {", ".join(images)} export')
+        formats = [fmt for fmt in formats if fmt in ('html', 'json')]
+
+    manifest_path = os.path.join(outdir, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    status, todo = {}, {}
+    for name, fig in figures.items():
+        digest, fig_json = (digests or {}).get(name), None
+        if digest is None:
+            fig_json = (fig() if callable(fig) else fig).to_json()
+            digest = hashlib.sha256(fig_json.encode()).hexdigest()
+        base = os.path.join(outdir, _filename(name))
+
+        previous = manifest.get(name, {})
+        if (not force and previous.get('hash') == digest and set(formats) <= set(previous.get('formats', []))
+                and all(os.path.exists(f'{base}.{fmt}') for fmt in formats)):
+            status[name] = 'unchanged'
+            continue
+
+        if fig_json is None:
+            fig_json = (fig() if callable(fig) else fig).to_json()
+        todo[name] = (fig_json, base)
+        manifest[name] = {'hash': digest, 'formats': formats}
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(todo) <= 1:
+        for name, (fig_json, base) in todo.items():
+            _write_figure(fig_json, base, formats)
+            status[name] = 'written'
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            futures = {name: pool.submit(_write_figure, fig_json, base, formats)
+                       for name, (fig_json, base) in todo.items()}
+            for name, future in futures.items():
+                future.result()
+                status[name] = 'written'
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return status
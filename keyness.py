@@ -0,0 +1,86 @@
+"""
+keyness.py: which words are distinctive for a document (or group of documents) compared to the rest of the corpus
+
+Every statistic is computed for all (group, word) pairs at once from the non-zero entries of a
+sparse group-term count matrix: a word a group never uses cannot be distinctive for it.
+"""
+
+import numpy as np
+
+STATISTICS = ['log_likelihood', 'chi_square', 'log_ratio']
+
+
+def keyness(matrix, words, labels, groups=None):
+    """
+    Keyness of every word used by each group against all other groups
+    :param matrix: scipy.sparse count matrix, one row per document and one column per word
+    :param words: list of the words of the columns
+    :param labels: list of the documents of the rows
+    :param groups: optional list with the group of each document (default every document is its own group)
+    :return: DataFrame with one row per (group, word) pair used by the group: count, rest (count in the other
+             groups), expected count, signed log-likelihood (G2; negative when the group uses the word less than
+             expected), chi-square and log2 ratio of the relative frequencies (0.5 added to both counts)
+    """
+    import pandas as pd
+    from scipy import sparse
+
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+
+    # sum the documents of each group with one sparse product
+    if groups is None:
+        names, codes = np.asarray(labels, dtype=object), np.arange(len(labels))
+    else:
+        names, codes = np.unique(np.asarray(groups, dtype=object), return_inverse=True)
+    indicator = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))),
+                                  shape=(len(names), len(codes)))
+    grouped = (indicator @ matrix).tocoo()
+
+    # 2 x 2 contingency table of each pair: the word in the group and elsewhere, other words in each
+    a = grouped.data
+    word_totals = np.asarray(matrix.sum(axis=0)).ravel()
+    group_sizes = np.asarray(indicator @ matrix.sum(axis=1)).ravel()
+    total = word_totals.sum()
+
+    b = word_totals[grouped.col] - a
+    c = group_sizes[grouped.row]
+    d = total - c
+
+    expected_group = c * (a + b) / total
+    expected_rest = d * (a + b) / total
+
+    # 0 * log(0) counts as 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g2 = 2 * (a * np.log(a / expected_group) + np.where(b > 0, b * np.log(b / expected_rest), 0))
+        chi2 = total * (a * (d - b) - b * (c - a)) ** 2 / ((a + b) * (c + d - a - b) * c * d)
+    chi2 = np.nan_to_num(chi2)
+
+    df = pd.DataFrame({
+        'group': names[grouped.row],
+        'word': np.asarray(words, dtype=object)[grouped.col],
+        'count': a.astype(np.int64),
+        'rest': b.astype(np.int64),
+        'expected': expected_group,
+        'log_likelihood': np.where(a < expected_group, -g2, g2),
+        'chi_square': chi2,
+        'log_ratio': np.log2(((a + 0.5) / c) / ((b + 0.5) / np.maximum(d, 1)))
+    })
+    return df
+
+
+def rank(df, statistic='log_likelihood', k=None, min_count=1):
+    """
+    Order a keyness table from most to least distinctive within each group
+    :param df: DataFrame from keyness
+    :param statistic: str; column to rank by
+    :param k: int; keep the k most distinctive words of each group (default all)
+    :param min_count: int; ignore words the group uses fewer times
+    :return: DataFrame sorted by group and descending statistic
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f'unknown keyness statistic {statistic!r} (choose from {STATISTICS})')
+
+    df = df[df['count'] >= min_count]
+    df = df.sort_values(['group', statistic, 'word'], ascending=[True, False, True], kind='stable')
+    if k is not None:
+        df = df.groupby('group', sort=False).head(k)
+    return df.reset_index(drop=True)
@@ -1,26 +1,267 @@
+"""
+Command line pipeline: parse a folder (or manifest) of Zoom transcripts and write per-meeting and corpus summaries
+
+Usage:
+    python main.py lecturetranscripts --speaker "john rachlin" --out summaries
+    python main.py manifest.csv --out summaries --format json parquet --charts
+
+A manifest is a .csv or .json list of records with a path and optional label and speaker.
+Re-runs only parse transcripts that are new or whose contents (or label / speaker) changed,
+and merge them into the summaries already in the output directory.
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import re
+import warnings
+import numpy as np
+from cache import file_digest
+from corpus import CorpusIndex
 from transcripts import ZoomTranscript
+from validation import skip_report
+
+STATE = 'manifest.json'
+
+
+def read_inputs(source, speaker=None):
+    """
+    List the transcripts to process
+    :param source: str; directory, glob pattern, or .csv / .json manifest with path, label and speaker fields
+    :param speaker: str; speaker for entries that do not name one
+    :return: list of dicts {path, label, speaker}
+    """
+    if source.endswith('.csv'):
+        with open(source, newline='') as f:
+            rows = list(csv.DictReader(f))
+    elif source.endswith('.json'):
+        with open(source) as f:
+            rows = json.load(f)
+    else:
+        rows = [{'path': path} for path in ZoomTranscript._expand_paths(source)]
+
+    entries = []
+    for row in rows:
+        path = row['path']
+        entries.append({'path': path,
+                        'label': row.get('label') or os.path.splitext(os.path.basename(path))[0],
+                        'speaker': row.get('speaker') or speaker})
+    return entries
+
+
+def _filename(label):
+    """ turn a meeting label into a safe file name """
+    return re.sub(r'[^\w.-]+', '_', label).strip('_') or 'meeting'
+
+
+def meeting_summary(corpus, label, entry, digest):
+    """
+    Summarize one loaded meeting
+    :param corpus: ZoomTranscript the meeting was loaded into
+    :param label: label of the meeting
+    :param entry: dict {path, label, speaker}
+    :param digest: str; hash of the transcript
+    :return: json serializable dict
+    """
+    wordcount = corpus.data['wordcount'][label]
+    return {
+        'label': label,
+        'path': entry['path'],
+        'speaker': entry['speaker'],
+        'sha256': digest,
+        'numwords': corpus.data['numwords'][label],
+        'sentiment': corpus.data['sentiment'][label],
+        'sentence_stats': corpus.data['sentence_stats'][label],
+        'sentence_hist': corpus.data['sentence_hist'][label].tolist(),
+        'top_words': wordcount.most_common(25),
+        'wordcount': dict(wordcount)
+    }
+
+
+def corpus_summary(meetings):
+    """
+    Combine meeting summaries into corpus-wide statistics
+    :param meetings: list of meeting summaries
+    :return: json serializable dict
+    """
+    index = CorpusIndex()
+    hist = np.zeros(0, dtype=np.int64)
+    numwords = sum(meeting['numwords'] for meeting in meetings)
+
+    sentiment = dict.fromkeys(['neg', 'neu', 'pos', 'compound'], 0.0)
+    for meeting in meetings:
+        index.add(meeting['wordcount'])
+
+        # the corpus sentiment is the word-weighted average of the meetings
+        for key in sentiment:
+            sentiment[key] += meeting['sentiment'][key] * meeting['numwords'] / max(numwords, 1)
+
+        # sentence length histograms add up
+        meeting_hist = np.asarray(meeting['sentence_hist'], dtype=np.int64)
+        if len(meeting_hist) > len(hist):
+            hist = np.concatenate([hist, np.zeros(len(meeting_hist) - len(hist), dtype=np.int64)])
+        hist[:len(meeting_hist)] += meeting_hist
+
+    return {
+        'meetings': len(meetings),
+        'numwords': numwords,
+        'vocabulary': len(index),
+        'sentiment': {key: round(value, 4) for key, value in sentiment.items()},
+        'sentence_stats': ZoomTranscript.hist_stats(hist),
+        'top_words': index.top_k(50)
+    }
+
+
+def write_parquet(meetings, filename):
+    """
+    Write one row per meeting (without the word counts) as a Parquet table
+    :param meetings: list of meeting summaries
+    :param filename: str; output file
+    :return: none
+    """
+    # pandas writes Parquet with pyarrow or fastparquet; without either, the other outputs are still written
+    if importlib.util.find_spec('pyarrow') is None and importlib.util.find_spec('fastparquet') is None:
+        warnings.warn(f'neither pyarrow nor fastparquet is installed, skipping {filename}')
+        return
+
+    import pandas as pd
+
+    rows = [{'label': m['label'], 'path': m['path'], 'speaker': m['speaker'], 'numwords': m['numwords'],
+             **{f'sentiment_{k}': v for k, v in m['sentiment'].items()},
+             **{f'sentence_{k}': v for k, v in m['sentence_stats'].items()}} for m in meetings]
+    pd.DataFrame(rows).to_parquet(filename, index=False)
+
+
+def run(source, outdir='summaries', speaker=None, workers=None, formats=('json',), stopfile=None,
+        cache=None, charts=False):
+    """
+    Process new or changed transcripts and refresh the summaries in outdir
+    :param source: str; directory, glob pattern or manifest of transcripts
+    :param outdir: str; output directory
+    :param speaker: str; speaker to analyse when the manifest does not name one
+    :param workers: int; number of worker processes
+    :param formats: list of output formats for the meeting table ('json', 'parquet')
+    :param stopfile: file to remove stop words by
+    :param cache: str; optional parse cache directory
+    :param charts: bool; also export the charts for the whole corpus
+    :return: dict {'processed': labels, 'unchanged': labels, 'errors': {path: message}}
+    """
+    meeting_dir = os.path.join(outdir, 'meetings')
+    os.makedirs(meeting_dir, exist_ok=True)
+
+    state_path = os.path.join(outdir, STATE)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    # find what changed since the last run
+    entries = read_inputs(source, speaker)
+    todo, unchanged, errors = [], [], {}
+    for entry in entries:
+        try:
+            digest = file_digest(entry['path'])
+        except OSError as e:
+            errors[entry['path']] = str(e)
+            continue
+
+        previous = state.get(entry['path'], {})
+        output = os.path.join(meeting_dir, _filename(entry['label']) + '.json')
+        if (previous.get('sha256') == digest and previous.get('label') == entry['label']
+                and previous.get('speaker') == entry['speaker'] and os.path.exists(output)):
+            unchanged.append(entry['label'])
+        else:
+            todo.append((entry, digest))
+
+    # parse the changed transcripts in parallel, one batch per speaker
+    corpus = ZoomTranscript(cache=cache)
+    for batch_speaker in dict.fromkeys(entry['speaker'] for entry, _ in todo):
+        batch = [entry for entry, _ in todo if entry['speaker'] == batch_speaker]
+        kwargs = {'speaker': batch_speaker} if batch_speaker else {}
+        if stopfile:
+            kwargs['stopfile'] = stopfile
+        failed = corpus.load_texts([entry['path'] for entry in batch], labels=[entry['label'] for entry in batch],
+                                   workers=workers, **kwargs)
+        # files failing a pre-flight check are skipped with the reason, the rest of the batch goes on
+        errors.update({skip.filename: skip.reason for skip in skip_report(failed)})
+
+    processed = []
+    for entry, digest in todo:
+        if entry['path'] in errors:
+            continue
+
+        # an old summary under a different label is replaced by the new one
+        old_label = state.get(entry['path'], {}).get('label')
+        if old_label and old_label != entry['label']:
+            old_output = os.path.join(meeting_dir, _filename(old_label) + '.json')
+            if os.path.exists(old_output):
+                os.remove(old_output)
+
+        summary = meeting_summary(corpus, entry['label'], entry, digest)
+        with open(os.path.join(meeting_dir, _filename(entry['label']) + '.json'), 'w') as f:
+            json.dump(summary, f)
+
+        state[entry['path']] = {'sha256': digest, 'label': entry['label'], 'speaker': entry['speaker']}
+        processed.append(entry['label'])
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+    # the corpus summary merges every meeting summary, old and new
+    meetings = []
+    for record in state.values():
+        output = os.path.join(meeting_dir, _filename(record['label']) + '.json')
+        if os.path.exists(output):
+            with open(output) as f:
+                meetings.append(json.load(f))
+
+    with open(os.path.join(outdir, 'corpus.json'), 'w') as f:
+        json.dump(corpus_summary(meetings), f, indent=2)
+
+    if 'parquet' in formats:
+        write_parquet(meetings, os.path.join(outdir, 'meetings.parquet'))
+
+    if charts:
+        # charts cover the whole corpus, so load any meetings this run did not parse (from the cache if given);
+        # a transcript deleted or broken since its summary was written is left out of the charts and reported
+        failed = {}
+        for meeting in meetings:
+            if meeting['label'] not in corpus.data['wordcount']:
+                kwargs = {'speaker': meeting['speaker']} if meeting['speaker'] else {}
+                try:
+                    corpus.load_text(meeting['path'], label=meeting['label'], stopfile=stopfile, **kwargs)
+                except Exception as e:
+                    failed[meeting['path']] = e
+        errors.update({skip.filename: skip.reason for skip in skip_report(failed)})
+        corpus.export(os.path.join(outdir, 'charts'), workers=workers)
+
+    return {'processed': processed, 'unchanged': unchanged, 'errors': errors}
 
 
 def main():
-    ds3500 = ZoomTranscript()
-
-    # read in text files
-    ds3500.load_text('lecturetranscripts/02-14-23.txt', label='DS3500 Feb 14',
-                     speaker='john rachlin')
-    ds3500.load_text('lecturetranscripts/02-17-23.txt', label='DS3500 Feb 17',
-                     speaker='john rachlin')
-    ds3500.load_text('lecturetranscripts/02-21-23.txt', label='DS3500 Feb 21',
-                     speaker='john rachlin')
-    ds3500.load_text('lecturetranscripts/02-24-23.txt', label='DS3500 Feb 24',
-                     speaker='john rachlin'),
-    ds3500.load_text('lecturetranscripts/02-03-23.txt', label='DS3500 Feb 03',
-                     speaker='john rachlin')
-
-    # create visualizations
-    ds3500.wordcount_sankey(k=15)
-    ds3500.sent_over_time(n=15)
-    ds3500.pie_chart(slices=20)
-    ds3500.subplot_bar()
+    parser = argparse.ArgumentParser(description='Summarize a folder of Zoom transcripts')
+    parser.add_argument('source', help='directory, glob pattern, or .csv / .json manifest (path, label, speaker)')
+    parser.add_argument('--out', default='summaries', help='output directory')
+    parser.add_argument('--speaker', help='speaker to analyse when the manifest does not name one '
+                                          '(default: everyone)')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: cpu count)')
+    parser.add_argument('--format', nargs='+', default=['json'], choices=['json', 'parquet'],
+                        help='formats of the meeting table (per-meeting json summaries are always written)')
+    parser.add_argument('--stopfile', help='file of stop words to use instead of the nltk list')
+    parser.add_argument('--cache', help='directory of the parse cache')
+    parser.add_argument('--charts', action='store_true', help='also export the corpus charts')
+    args = parser.parse_args()
+
+    result = run(args.source, args.out, args.speaker, args.workers, args.format, args.stopfile,
+                 args.cache, args.charts)
+
+    print(f"processed {len(result['processed'])}, unchanged {len(result['unchanged'])}, "
+          f"failed {len(result['errors'])}")
+    for path, error in result['errors'].items():
+        print(f'could not parse {path}: {error}')
 
 
 if __name__ == "__main__":
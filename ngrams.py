@@ -0,0 +1,192 @@
+"""
+ngrams.py: phrase (n-gram) counting for Wordie
+
+Every document's phrases are counted exactly when it is parsed. Corpus-wide totals are kept
+either exactly (a CorpusIndex per phrase length) or, for archives too large for that, in a
+count-min sketch with a bounded set of heavy-hitter candidates. Hashing uses crc32, so
+sketches built in different processes or runs agree.
+"""
+
+from collections import Counter
+import heapq
+from operator import itemgetter
+import zlib
+import numpy as np
+from corpus import CorpusIndex
+
+# phrase lengths counted by the default parsers
+NGRAM_SIZES = (2, 3)
+
+
+def ngram_counts(words, sizes=NGRAM_SIZES):
+    """
+    Count the phrases of consecutive words
+    :param words: list of words
+    :param sizes: phrase lengths to count
+    :return: dict {n: Counter {phrase: count}}, phrases joined by single spaces
+    """
+    return {n: Counter(map(' '.join, zip(*[words[i:] for i in range(n)]))) for n in sizes}
+
+
+class CountMinSketch:
+    """
+    Fixed-size table of counters; each phrase is hashed to one counter per row and its
+    count is estimated by the smallest of them (never below the true count)
+    """
+
+    def __init__(self, width=2 ** 18, depth=4):
+        """
+        :param width: int; counters per row
+        :param depth: int; number of rows (hash functions)
+        """
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def _cells(self, phrases):
+        """ flat table positions of every phrase, one row per hash function (depth x phrases) """
+        encoded = [phrase.encode() for phrase in phrases]
+        h1 = np.fromiter((zlib.crc32(b) for b in encoded), dtype=np.uint64, count=len(encoded))
+        h2 = np.fromiter((zlib.crc32(b, 0x9E3779B9) for b in encoded), dtype=np.uint64, count=len(encoded)) | 1
+
+        # double hashing: row i uses h1 + i * h2
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return (rows * self.width + (h1 + rows * h2) % self.width).astype(np.int64)
+
+    def update(self, counts, sign=1):
+        """
+        Add (or take out) phrase counts
+        :param counts: dict {phrase: count}
+        :param sign: 1 to add, -1 to take out
+        :return: array of the updated estimates of the phrases, in the order of counts
+        """
+        if not counts:
+            return np.zeros(0, dtype=np.int64)
+
+        cells = self._cells(counts)
+        values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+        np.add.at(self.table.ravel(), cells.ravel(), sign * np.tile(values, self.depth))
+        return self.table.ravel()[cells].min(axis=0)
+
+    def estimate(self, phrases):
+        """
+        :param phrases: list of phrases
+        :return: array of estimated counts
+        """
+        if not phrases:
+            return np.zeros(0, dtype=np.int64)
+        return self.table.ravel()[self._cells(phrases)].min(axis=0)
+
+
+class PhraseSketch:
+    """
+    Approximate corpus-wide counts of one phrase length: a count-min sketch plus the
+    `capacity` phrases with the highest estimates seen so far
+    """
+
+    def __init__(self, width=2 ** 18, depth=4, capacity=1000):
+        """
+        :param width: int; counters per row of the sketch
+        :param depth: int; rows of the sketch
+        :param capacity: int; number of heavy-hitter candidates kept for top-k queries
+        """
+        self.sketch = CountMinSketch(width, depth)
+        self.capacity = capacity
+        self.candidates = {}
+
+    def _refresh(self, phrases, estimates):
+        """ merge new estimates into the candidates and drop all but the largest """
+        self.candidates.update(zip(phrases, estimates.tolist()))
+        if len(self.candidates) > self.capacity:
+            self.candidates = dict(heapq.nlargest(self.capacity, self.candidates.items(), key=itemgetter(1)))
+
+    def add(self, counts):
+        """
+        :param counts: dict {phrase: count} of a document
+        :return: none
+        """
+        self._refresh(list(counts), self.sketch.update(counts))
+
+    def remove(self, counts):
+        """
+        :param counts: dict {phrase: count} of a document
+        :return: none
+        """
+        estimates = self.sketch.update(counts, -1)
+        for phrase, estimate in zip(counts, estimates.tolist()):
+            if phrase in self.candidates:
+                if estimate > 0:
+                    self.candidates[phrase] = estimate
+                else:
+                    del self.candidates[phrase]
+
+    def top_k(self, k=5):
+        """
+        :param k: int; number of phrases (at most the capacity)
+        :return: list of (phrase, estimated count), most frequent first
+        """
+        phrases = list(self.candidates)
+        return heapq.nlargest(k, zip(phrases, self.sketch.estimate(phrases).tolist()), key=itemgetter(1))
+
+    def __len__(self):
+        return len(self.candidates)
+
+
+class PhraseIndex:
+    """
+    Corpus-wide phrase counts for each phrase length, updated as documents are added or removed
+    """
+
+    def __init__(self, mode='exact', sizes=NGRAM_SIZES, width=2 ** 18, depth=4, capacity=1000, keep=200):
+        """
+        :param mode: str; 'exact' keeps every phrase count, 'approx' keeps memory bounded with sketches
+        :param sizes: phrase lengths to index
+        :param width: int; (approx) counters per row of each sketch
+        :param depth: int; (approx) rows of each sketch
+        :param capacity: int; (approx) heavy-hitter candidates kept per phrase length
+        :param keep: int; (approx) phrases kept per document and length for per-document queries
+        """
+        if mode not in ('exact', 'approx'):
+            raise ValueError(f'unknown phrase counting mode {mode!r}')
+
+        self.mode = mode
+        self.sizes = tuple(sizes)
+        self.keep = keep
+        if mode == 'exact':
+            self.counts = {n: CorpusIndex() for n in self.sizes}
+        else:
+            self.counts = {n: PhraseSketch(width, depth, capacity) for n in self.sizes}
+
+    def add(self, phrases):
+        """
+        Add a document's phrases to the corpus totals
+        :param phrases: dict {n: {phrase: count}} of the document
+        :return: the phrase counts to store with the document (in approx mode only its most frequent phrases)
+        """
+        stored = {}
+        for n in self.sizes:
+            counts = phrases.get(n, {})
+            self.counts[n].add(counts)
+            stored[n] = counts if self.mode == 'exact' else Counter(dict(counts.most_common(self.keep)))
+        return stored
+
+    def remove(self, phrases):
+        """
+        Take a document's stored phrases out of the corpus totals
+        (in approx mode only its kept phrases are taken out, so estimates stay upper bounds)
+        :param phrases: dict {n: {phrase: count}} as returned by add
+        :return: none
+        """
+        for n in self.sizes:
+            self.counts[n].remove(phrases.get(n, {}))
+
+    def top_k(self, k=5, n=2):
+        """
+        Most frequent phrases across the corpus
+        :param k: int; number of phrases
+        :param n: int; phrase length
+        :return: list of (phrase, count), most frequent first
+        """
+        if n not in self.counts:
+            raise ValueError(f'phrases of length {n} are not indexed (indexed: {self.sizes})')
+        return self.counts[n].top_k(k)
@@ -0,0 +1,147 @@
+"""
+profiling.py: per-stage instrumentation for the Wordie framework
+
+A Profiler records wall time, call counts, bytes read, token counts and (optionally) peak
+memory for each named stage. Wordie objects without a profiler use NULL_STAGE, which does nothing.
+"""
+
+import functools
+import time
+import tracemalloc
+
+FIELDS = ['calls', 'seconds', 'bytes', 'tokens', 'peak_memory']
+
+
+class _Stage:
+    """ context manager timing one run of a stage """
+    __slots__ = ['profiler', 'name', 'counts', 'start', 'memory_start']
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.counts = {}
+
+    def add(self, **counts):
+        """
+        Count something the stage processed, e.g. add(bytes=1024) or add(tokens=300)
+        """
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        if self.profiler.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if self.profiler.memory:
+            self.counts['peak_memory'] = tracemalloc.get_traced_memory()[1] - self.memory_start
+        self.profiler.record(self.name, seconds, self.counts)
+        return False
+
+
+class _NullStage:
+    """ stand-in used when profiling is off """
+    __slots__ = []
+
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """
+    Collects per-stage statistics and passes every finished stage to the registered hooks
+    """
+
+    def __init__(self, memory=False, hooks=None):
+        """
+        :param memory: bool; also track peak memory with tracemalloc (slows the stages down)
+        :param hooks: list of functions called as hook(stage, seconds, counts) after every stage
+        """
+        self.memory = memory
+        self.hooks = list(hooks or [])
+        self.records = {}
+
+    def stage(self, name):
+        """
+        :param name: str; name of the stage
+        :return: context manager timing the stage; call .add(bytes=..., tokens=...) on it to count work
+        """
+        return _Stage(self, name)
+
+    def add_hook(self, hook):
+        """
+        :param hook: function called as hook(stage, seconds, counts) after every stage
+        :return: none
+        """
+        self.hooks.append(hook)
+
+    def record(self, name, seconds, counts):
+        """
+        Add one finished run of a stage to the totals
+        :param name: str; name of the stage
+        :param seconds: float; wall time of the run
+        :param counts: dict of counters (bytes, tokens, peak_memory)
+        :return: none
+        """
+        totals = self.records.setdefault(name, dict.fromkeys(FIELDS, 0))
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        for key, value in counts.items():
+            # peak memory is the largest peak of any run, everything else adds up
+            totals[key] = max(totals.get(key, 0), value) if key == 'peak_memory' else totals.get(key, 0) + value
+
+        for hook in self.hooks:
+            hook(name, seconds, counts)
+
+    def merge(self, records):
+        """
+        Add the totals of another profiler (e.g. from a worker process)
+        :param records: dict {stage: totals} from Profiler.records
+        :return: none
+        """
+        for name, totals in records.items():
+            mine = self.records.setdefault(name, dict.fromkeys(FIELDS, 0))
+            for key, value in totals.items():
+                mine[key] = max(mine.get(key, 0), value) if key == 'peak_memory' else mine.get(key, 0) + value
+
+            for hook in self.hooks:
+                hook(name, totals['seconds'], {k: v for k, v in totals.items() if k not in ('calls', 'seconds')})
+
+    def report(self):
+        """
+        :return: DataFrame with one row per stage: calls, total and mean seconds, bytes, tokens, peak memory
+        """
+        import pandas as pd
+
+        df = pd.DataFrame.from_dict(self.records, orient='index', columns=FIELDS).fillna(0)
+        df.insert(2, 'mean_seconds', df['seconds'] / df['calls'].where(df['calls'] > 0))
+        return df.rename_axis('stage')
+
+    def reset(self):
+        self.records = {}
+
+
+def profiled(method):
+    """
+    Decorator timing a Wordie method as a stage named after the method
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._stage(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
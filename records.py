@@ -0,0 +1,143 @@
+"""
+records.py: compact storage of each document's results
+
+A DocumentRecord keeps every statistic of one document in fixed slots (results that are not
+one of the known fields go into a small dict). Wordie.data is a DataView over the records, so
+data[stat][label] reads and writes work as they did when every statistic was its own dict.
+"""
+
+from collections.abc import Mapping, MutableMapping
+import numpy as np
+
+# statistics produced by the default parsers, in the order they are listed
+FIELDS = ('plain_text', 'wordcount', 'numwords', 'phrases', 'sentiment', 'sentiment_profile', 'sentence_length',
+          'sentence_hist', 'sentence_stats', 'turn_start', 'turn_end', 'turn_words', 'turn_sentiment', 'talk')
+
+_SLOTS = frozenset(FIELDS)
+
+
+class DocumentRecord:
+    """
+    Results of one document; fields that were never set (or were not kept) are missing
+    """
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self):
+        self.extra = None
+
+    def get(self, field, default=None):
+        """
+        :param field: str; name of the statistic
+        :param default: value returned if the record does not have the field
+        :return: the stored value
+        """
+        if field in _SLOTS:
+            return getattr(self, field, default)
+        return self.extra.get(field, default) if self.extra else default
+
+    def set(self, field, value):
+        """
+        :param field: str; name of the statistic
+        :param value: value to store (sentence lengths are stored as an int32 array)
+        :return: none
+        """
+        if field == 'sentence_length':
+            value = np.asarray(value, dtype=np.int32)
+
+        if field in _SLOTS:
+            setattr(self, field, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[field] = value
+
+    def discard(self, field):
+        """
+        :param field: str; name of the statistic to drop (nothing happens if it is missing)
+        :return: none
+        """
+        if field in _SLOTS:
+            if hasattr(self, field):
+                delattr(self, field)
+        elif self.extra:
+            self.extra.pop(field, None)
+
+    def has(self, field):
+        return hasattr(self, field) if field in _SLOTS else bool(self.extra) and field in self.extra
+
+    def fields(self):
+        """
+        :return: list of the fields the record has
+        """
+        return [field for field in FIELDS if hasattr(self, field)] + list(self.extra or ())
+
+
+class FieldView(MutableMapping):
+    """
+    {label: value} view of one statistic across the records that have it
+    """
+
+    def __init__(self, records, field):
+        self.records = records
+        self.field = field
+
+    def __getitem__(self, label):
+        record = self.records.get(label)
+        if record is None or not record.has(self.field):
+            raise KeyError(label)
+        return record.get(self.field)
+
+    def __setitem__(self, label, value):
+        record = self.records.get(label)
+        if record is None:
+            record = self.records[label] = DocumentRecord()
+        record.set(self.field, value)
+
+    def __delitem__(self, label):
+        if label not in self:
+            raise KeyError(label)
+        self.records[label].discard(self.field)
+
+    def __contains__(self, label):
+        record = self.records.get(label)
+        return record is not None and record.has(self.field)
+
+    def __iter__(self):
+        return (label for label, record in self.records.items() if record.has(self.field))
+
+    def __len__(self):
+        return sum(1 for record in self.records.values() if record.has(self.field))
+
+
+class DataView(Mapping):
+    """
+    {stat: {label: value}} view over the document records; any stat can be looked up
+    (an unknown one is simply empty), and some stats can be served by other storage.
+    Stats of a loaded snapshot can be pending: they are read into the records the first time they are looked up
+    """
+
+    def __init__(self, records, overrides=None):
+        """
+        :param records: dict {label: DocumentRecord}
+        :param overrides: dict {stat: mapping} of stats stored elsewhere (e.g. the sparse word counts)
+        """
+        self.records = records
+        self.overrides = dict(overrides or {})
+        self.pending = {}
+
+    def __getitem__(self, stat):
+        if stat in self.pending:
+            self.pending.pop(stat)()
+        if stat in self.overrides:
+            return self.overrides[stat]
+        return FieldView(self.records, stat)
+
+    def __iter__(self):
+        stats = dict.fromkeys(self.overrides)
+        stats.update(dict.fromkeys(self.pending))
+        for record in self.records.values():
+            stats.update(dict.fromkeys(record.fields()))
+        return iter(stats)
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -6,91 +6,99 @@ How to make links and nodes same color:
 https://stackoverflow.com/questions/69494044/making-the-color-of-links-the-same-as-source-nodes-in-sankey-plot-plotly-in-r
 """
 
-import plotly.graph_objects as go
-import plotly.express as px
 import numpy as np
-import pandas as pd
 
+# pandas and plotly are imported when a diagram is first made, so importing this module stays cheap
 
-def _code_mapping(df, src, targ):
-    # Get distinct labels
-    labels = sorted(list(set(list(df[src]) + list(df[targ]))))
 
-    # Get integer codes
-    codes = list(range(len(labels)))
+def _column_codes(values):
+    """
+    Factorize a column into integer codes over its distinct upper-cased labels
+    :param values: Series or array of node values
+    :return: (array of codes, array of labels)
+    """
+    import pandas as pd
+
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+
+    # upper-case only the distinct values, then merge any that now coincide
+    upper = pd.Index(uniques).astype(str).str.upper()
+    merged, labels = pd.factorize(upper)
+
+    return merged[codes], np.asarray(labels, dtype=object)
+
+
+def _links(df, cols, vals=None, prep=True):
+    """
+    Build the links between each pair of consecutive columns without modifying df
+    :param df: dataframe
+    :param cols: list; columns to chain together
+    :param vals: str; column with link values (only used if prep is False)
+    :param prep: boolean; if true, the value of a link is the number of rows that connect its two nodes
+    :return: (array of source labels, array of target labels, array of values)
+    """
+    codes = [_column_codes(df[col]) for col in cols]
 
-    # Create label to code mapping
-    lc_map = dict(zip(labels, codes))
+    sources, targets, values = [], [], []
+    for (src, src_labels), (targ, targ_labels) in zip(codes, codes[1:]):
+        if prep:
+            # count each distinct (source, target) pair through one combined integer key
+            key = src.astype(np.int64) * len(targ_labels) + targ
+            pairs, counts = np.unique(key, return_counts=True)
+            src, targ = pairs // len(targ_labels), pairs % len(targ_labels)
+        else:
+            counts = df[vals].to_numpy() if vals else np.ones(len(src), dtype=np.int64)
 
-    # Substitute names for codes in dataframe
-    df = df.replace({src: lc_map, targ: lc_map})
+        sources.append(src_labels[src])
+        targets.append(targ_labels[targ])
+        values.append(counts)
 
-    return df, labels
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(values)
 
 
 def make_sankey(df, cols, vals=None, title=None, threshold=20, prep=True, **kwargs):
     """
     Create a sankey diagram linking src values to
-    target values with thickness vals
+    target values with thickness vals. Node labels are upper-cased, and the
+    same label in different columns is the same node. df is not modified
     :param df: dataframe
-    :param cols: list; columns to plot data from
+    :param cols: list; columns to plot data from (each column links to the next one)
     :param vals: str; column with values that correspond to link thickness
     :param title: str; title of graph
     :param threshold: int; threshold to filter values based on
     :param prep: boolean; if true, preps dataframe for analysis by aggregating and labeling
     :param kwargs: optional parameters for go.sankey function
 
-    :return: nothing. plots a sankey diagram
+    :return: the sankey figure
     """
+    import pandas as pd
+    import plotly.graph_objects as go
+    import plotly.express as px
+
     if len(cols) < 2:
         raise Exception('must pass at least two columns')
 
-    # make new df to hold sankey data
-    sankey_df = pd.DataFrame()
-
-    for col in cols:
-        df[col] = df[col].astype(str).str.upper()
-
-    if prep:
-        vals = 'count'
-
-        # merge all source --> target mapping under two columns
-        for i in range(len(cols)-1):
-            cur_df = df[[cols[i], cols[i + 1]]]
-            cur_df = cur_df.groupby([cols[i], cols[i + 1]]).size().reset_index(name='count')
-            cur_df.columns = ['source', 'target', 'count']
-            sankey_df = pd.concat([sankey_df, cur_df])
-    else:
-        # label columns
-        sankey_df = df
-        sankey_df.columns = ['source', 'target', 'count']
+    sources, targets, values = _links(df, cols, vals, prep)
 
     # filter on threshold
-    sankey_df = sankey_df[sankey_df['count'] >= threshold]
+    keep = values >= threshold
+    sources, targets, values = sources[keep], targets[keep], values[keep]
 
-    # mapping
-    sankey_df, labels = _code_mapping(sankey_df, 'source', 'target')
+    # mapping: one code per distinct label, in sorted label order
+    codes, labels = pd.factorize(np.concatenate([sources, targets]), sort=True)
+    source_codes, target_codes = codes[:len(sources)], codes[len(sources):]
 
-    if vals:
-        values = sankey_df['count']
-    else:
-        values = [1] * len(sankey_df)
+    if not (vals or prep):
+        values = np.ones(len(sources), dtype=np.int64)
 
     # match link colors to node colors
-    nodes = np.unique(sankey_df[['source', 'target']], axis=None)
-    nodes = pd.Series(index=nodes, data=range(len(nodes)))
-    link_colors = [
-        'rgba' +
-        str(px.colors.hex_to_rgb(px.colors.qualitative.Plotly[i % len(px.colors.qualitative.Plotly)]) + (0.3,))
-        for i in nodes.loc[sankey_df['source']]
-        ]
-    node_colors = [
-        px.colors.qualitative.Plotly[i % len(px.colors.qualitative.Plotly)]
-        for i in nodes
-        ]
+    palette = px.colors.qualitative.Plotly
+    link_palette = np.array(['rgba' + str(px.colors.hex_to_rgb(color) + (0.3,)) for color in palette], dtype=object)
+    node_colors = np.array(palette, dtype=object)[np.arange(len(labels)) % len(palette)]
+    link_colors = link_palette[source_codes % len(palette)]
 
     # establish links
-    link = {'source': sankey_df['source'], 'target': sankey_df['target'], 'value': values,
+    link = {'source': source_codes, 'target': target_codes, 'value': values,
             'color': link_colors}
 
     # adjust padding width and thickness of links
@@ -98,11 +106,12 @@ def make_sankey(df, cols, vals=None, title=None, threshold=20, prep=True, **kwar
     thickness = kwargs.get('thickness', 20)
 
     # establish nodes
-    node = {'label': labels, 'thickness': thickness, 'pad': pad, 'color': node_colors}
+    node = {'label': list(labels), 'thickness': thickness, 'pad': pad, 'color': node_colors}
 
-    # construct sankey
-    sk = go.Sankey(link=link, node=node)
-    fig = go.Figure(sk)
+    # construct sankey; the link and node arrays are built above, so skip plotly's
+    # per-element validation, which dominates the cost for large numbers of links
+    sk = go.Sankey(link=link, node=node, _validate=False)
+    fig = go.Figure(sk, _validate=False)
     fig.update_layout(title_text=title)
 
     return fig
@@ -0,0 +1,187 @@
+"""
+search.py: positional inverted index for keyword-in-context search
+
+Each document is stored as its sorted term ids with, for every term, the delta-encoded
+token positions where it occurs. Term ids map to the documents containing them, so a
+phrase or proximity query only decodes the positions of its own terms in candidate
+documents. Token positions are translated to speaker turns and timestamps with the
+turn lengths of Zoom transcripts.
+"""
+
+from array import array
+from collections import namedtuple
+import numpy as np
+
+# one match: document, first token position, speaker turn and its start (seconds; None if unknown),
+# and the words around the match with the match in [brackets]
+Hit = namedtuple('Hit', ['label', 'position', 'turn', 'time', 'snippet'])
+
+
+class PositionalIndex:
+    """
+    Maps terms to (document, token position) postings, with turn and timestamp lookups
+    """
+
+    def __init__(self):
+        self.vocab = {}
+        self.terms = []
+        self.docs = {}
+        self._term_docs = []
+        self._records = {}
+        self._next = 0
+
+    def _encode(self, terms, grow=True):
+        """ global ids of terms (-1 for unknown terms when not growing the vocabulary) """
+        ids = np.empty(len(terms), dtype=np.int32)
+        for i, term in enumerate(terms):
+            if term not in self.vocab:
+                if not grow:
+                    ids[i] = -1
+                    continue
+                self.vocab[term] = len(self.terms)
+                self.terms.append(term)
+                self._term_docs.append(array('I'))
+            ids[i] = self.vocab[term]
+        return ids
+
+    def add(self, label, words, turn_words=None, turn_start=None):
+        """
+        Index (or re-index) a document
+        :param label: label of the document
+        :param words: list of the document's tokens, in order
+        :param turn_words: optional array; number of tokens in each speaker turn
+        :param turn_start: optional array; start of each turn in seconds (NaN if unknown)
+        :return: none
+        """
+        if label in self.docs:
+            self.remove(label)
+
+        doc = self._next
+        self._next += 1
+
+        # global term id of every token
+        uniq, inverse = np.unique(np.array(words, dtype=str), return_inverse=True)
+        tokens = self._encode(uniq.tolist())[inverse] if len(words) else np.zeros(0, np.int32)
+
+        # group the token positions by term; positions stay ascending within each term
+        positions = np.argsort(tokens, kind='stable')
+        term_ids, starts = np.unique(tokens[positions], return_index=True)
+        offsets = np.append(starts, len(positions)).astype(np.int64)
+
+        # delta-encode each term's positions (its first position is kept as is)
+        deltas = positions.copy()
+        deltas[1:] -= positions[:-1]
+        deltas[starts] = positions[starts]
+
+        for term in term_ids.tolist():
+            self._term_docs[term].append(doc)
+
+        bounds = np.cumsum(turn_words, dtype=np.int64) if turn_words is not None else None
+        self._records[doc] = (label, term_ids.astype(np.int32), offsets, deltas.astype(np.uint32), bounds,
+                              None if turn_start is None else np.asarray(turn_start, dtype=np.float64))
+        self.docs[label] = doc
+
+    def remove(self, label):
+        """
+        Drop a document from the index (its postings are skipped from then on)
+        :param label: label of the document
+        :return: none
+        """
+        del self._records[self.docs.pop(label)]
+
+    def _positions(self, doc, term):
+        """ decoded token positions of a term id in a document """
+        _, term_ids, offsets, deltas, _, _ = self._records[doc]
+        i = np.searchsorted(term_ids, term)
+        if i == len(term_ids) or term_ids[i] != term:
+            return np.zeros(0, dtype=np.int64)
+        return np.cumsum(deltas[offsets[i]:offsets[i + 1]], dtype=np.int64)
+
+    def _candidates(self, ids):
+        """ documents containing every term id, in the order they were added """
+        if len(ids) == 0 or (ids < 0).any():
+            return []
+
+        docs = None
+        for term in sorted(set(ids.tolist()), key=lambda t: len(self._term_docs[t])):
+            docs = set(self._term_docs[term]) if docs is None else docs.intersection(self._term_docs[term])
+        return sorted(doc for doc in docs if doc in self._records)
+
+    def _phrase_positions(self, doc, ids):
+        """ positions where the terms occur consecutively """
+        found = self._positions(doc, ids[0])
+        for offset, term in enumerate(ids[1:], 1):
+            found = np.intersect1d(found, self._positions(doc, term) - offset, assume_unique=True)
+        return found
+
+    def _hit(self, doc, start, end, context, texts, words):
+        """ build a Hit for tokens [start, end) of a document """
+        label, _, _, _, bounds, turn_start = self._records[doc]
+
+        turn, time = None, None
+        if bounds is not None:
+            turn = int(np.searchsorted(bounds, start, side='right'))
+            if turn_start is not None and turn < len(turn_start) and not np.isnan(turn_start[turn]):
+                time = float(turn_start[turn])
+
+        # documents whose text was not kept have no snippet
+        snippet = None
+        if texts is not None and label in texts:
+            if doc not in words:
+                words[doc] = texts[label].split()
+            tokens = words[doc]
+            snippet = ' '.join(tokens[max(start - context, 0):start] + ['[' + ' '.join(tokens[start:end]) + ']']
+                               + tokens[end:end + context])
+
+        return Hit(label, start, turn, time, snippet)
+
+    def phrase(self, terms, context=8, texts=None, limit=None):
+        """
+        Find every occurrence of a phrase
+        :param terms: list of tokens making up the phrase
+        :param context: int; words of context on each side of a match
+        :param texts: optional mapping {label: text} the documents were indexed from, for snippets
+        :param limit: int; stop after this many hits (default all)
+        :return: list of Hit
+        """
+        ids = self._encode(terms, grow=False)
+        hits, words = [], {}
+        for doc in self._candidates(ids):
+            for start in self._phrase_positions(doc, ids).tolist():
+                hits.append(self._hit(doc, start, start + len(ids), context, texts, words))
+                if limit is not None and len(hits) >= limit:
+                    return hits
+        return hits
+
+    def near(self, first, second, window=10, context=8, texts=None, limit=None):
+        """
+        Find the places where two phrases occur within a window of each other (in either order)
+        :param first: list of tokens of the first phrase
+        :param second: list of tokens of the second phrase
+        :param window: int; largest distance in tokens between the starts of the two phrases
+        :param context: int; words of context on each side of a match
+        :param texts: optional mapping {label: text} the documents were indexed from, for snippets
+        :param limit: int; stop after this many hits (default all)
+        :return: list of Hit spanning both phrases, one per occurrence of the first phrase
+        """
+        first_ids, second_ids = self._encode(first, grow=False), self._encode(second, grow=False)
+        hits, words = [], {}
+        for doc in self._candidates(np.concatenate([first_ids, second_ids])):
+            a = self._phrase_positions(doc, first_ids)
+            b = self._phrase_positions(doc, second_ids)
+            if not len(a) or not len(b):
+                continue
+
+            # nearest occurrence of the second phrase at or after a - window
+            i = np.minimum(np.searchsorted(b, a - window), len(b) - 1)
+            close = np.abs(b[i] - a) <= window
+            for start_a, start_b in zip(a[close].tolist(), b[i][close].tolist()):
+                start = min(start_a, start_b)
+                end = max(start_a + len(first_ids), start_b + len(second_ids))
+                hits.append(self._hit(doc, start, end, context, texts, words))
+                if limit is not None and len(hits) >= limit:
+                    return hits
+        return hits
+
+    def __len__(self):
+        return len(self.docs)
@@ -0,0 +1,344 @@
+"""
+sentiment.py: shared VADER sentiment scoring
+
+Every sentence is scored once at load time. A document keeps only the token count and
+score of each sentence as prefix sums, so the sentiment of any stretch of the text
+(e.g. each of n equal segments) can be answered without re-running VADER.
+
+A streamed document is scored as it is read: its profile holds a bounded number of points, and
+the whole-text scores are running sums of the word valences.
+"""
+
+from array import array
+import string
+import numpy as np
+
+# order of the VADER scores kept for each sentence
+SCORES = ['neg', 'neu', 'pos', 'compound']
+
+# most points a streamed profile holds before neighbouring sentences are merged
+PROFILE_POINTS = 1 << 12
+
+
+class SentimentProfile:
+    """
+    Prefix sums of token-weighted sentence scores for one document
+    """
+    __slots__ = ['tokens', 'weighted']
+
+    def __init__(self, counts, scores):
+        """
+        :param counts: array; number of tokens in each sentence
+        :param scores: array; (sentences x 4) VADER neg, neu, pos and compound score of each sentence
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1, len(SCORES))
+
+        # sentences without tokens carry no weight
+        keep = counts > 0
+        counts, scores = counts[keep], scores[keep]
+
+        self.tokens = np.concatenate([[0], np.cumsum(counts)])
+        self.weighted = np.vstack([np.zeros(len(SCORES)), np.cumsum(scores * counts[:, None], axis=0)])
+
+    @classmethod
+    def from_sums(cls, tokens, weighted):
+        """
+        Rebuild a profile from stored prefix sums
+        :param tokens: array; prefix sums of the sentence token counts (starting at 0)
+        :param weighted: array; (sentences + 1 x 4) prefix sums of the token-weighted scores
+        :return: SentimentProfile
+        """
+        profile = cls.__new__(cls)
+        profile.tokens = tokens
+        profile.weighted = weighted
+        return profile
+
+    @property
+    def numtokens(self):
+        return int(self.tokens[-1])
+
+    def spans(self, bounds):
+        """
+        Net sentiment (pos - neg) of the consecutive stretches of text between token positions
+        :param bounds: array of increasing token positions (0 to numtokens)
+        :return: array of len(bounds) - 1 scores
+        """
+        bounds = np.asarray(bounds, dtype=np.float64)
+
+        # the prefix sums are piecewise linear within a sentence, so interpolate at the boundaries
+        net = self.weighted[:, SCORES.index('pos')] - self.weighted[:, SCORES.index('neg')]
+        cum = np.interp(bounds, self.tokens, net)
+
+        sizes = np.diff(bounds)
+        return np.divide(np.diff(cum), sizes, out=np.zeros(len(sizes)), where=sizes > 0)
+
+    def segments(self, n=10):
+        """
+        Net sentiment (pos - neg) of n equal, consecutive segments of the document
+        :param n: int; number of segments
+        :return: array of n scores
+        """
+        # segment boundaries in tokens; the last segment takes the remainder
+        step = self.numtokens // n
+        bounds = np.arange(n + 1) * step
+        bounds[-1] = self.numtokens
+
+        return self.spans(bounds)
+
+
+class ProfileStream:
+    """
+    SentimentProfile of sentences scored one at a time. Once it holds `points` sentences, every other
+    boundary is dropped and each point stands for twice as many sentences from then on, so memory is
+    bounded; spans then interpolate across the merged sentences. Shorter documents get the same
+    profile as SentimentEngine.profile
+    """
+
+    def __init__(self, points=PROFILE_POINTS):
+        """
+        :param points: int; (even) most sentences or groups of sentences held
+        """
+        self.points = points
+        self.tokens, self.weighted = array('q', [0]), array('d', [0.0] * len(SCORES))
+        self.total, self.sums = 0, [0.0] * len(SCORES)
+
+        # sentences per point, and sentences added since the last point
+        self.stride, self.waiting = 1, 0
+
+    def add(self, count, scores):
+        """
+        :param count: int; number of tokens of the sentence
+        :param scores: list of the SCORES of the sentence
+        :return: none
+        """
+        # sentences without tokens carry no weight
+        if not count:
+            return
+
+        self.total += count
+        for i, score in enumerate(scores):
+            self.sums[i] += score * count
+        self.waiting += 1
+        if self.waiting == self.stride:
+            self._point()
+
+    def _point(self):
+        """ add a boundary at the running sums """
+        self.tokens.append(self.total)
+        self.weighted.extend(self.sums)
+        self.waiting = 0
+
+        # an odd number of boundaries, so the first and the last are both kept
+        if len(self.tokens) > self.points:
+            self.tokens = self.tokens[::2]
+            self.weighted = array('d', np.frombuffer(self.weighted).reshape(-1, len(SCORES))[::2].tobytes())
+            self.stride *= 2
+
+    def profile(self):
+        """
+        :return: SentimentProfile of the sentences added
+        """
+        if self.waiting:
+            self._point()
+        return SentimentProfile.from_sums(np.array(self.tokens, dtype=np.int64),
+                                          np.frombuffer(self.weighted).reshape(-1, len(SCORES)).copy())
+
+
+class PolarityStream:
+    """
+    VADER scores of a lowercased text without "!" or "?" (which VADER reads as emphasis) fed in pieces, the same
+    as SentimentIntensityAnalyzer.polarity_scores on the whole text (up to rounding). VADER scores each word from the three words before it and the two after
+    it, and every occurrence of a word gets the valence of its first occurrence; its "but" rule weighs the words
+    before the first "but" by 0.5 and those after it by 1.5. So only the last few words, the valences of the
+    sentiment words seen so far (at most the lexicon) and running sums before and after the first "but" are held
+    """
+    # words kept before and after the word being scored
+    BEFORE, AFTER = 3, 2
+
+    def __init__(self, analyzer):
+        """
+        :param analyzer: nltk SentimentIntensityAnalyzer
+        """
+        self.analyzer = analyzer
+        self.constants = analyzer.constants
+
+        # scored words (at most BEFORE) followed by the words waiting for the ones after them
+        self.words, self.scored = [], 0
+        self.seen = {}
+        self.but = None
+
+        # sum of the positive valences, how many, sum of the negative ones, how many, and number of zeros,
+        # for the words before the first "but", the "but" itself and the words after it
+        self.sums = [[0.0, 0, 0.0, 0, 0] for _ in range(3)]
+        # the lowercased text has no ALL CAPS words to stand out
+        self.is_cap_diff = False
+
+    def feed(self, words):
+        """
+        :param words: list of the next words of the text (split on whitespace)
+        :return: none
+        """
+        self.words.extend(self._split(words))
+        self._score(len(self.words) - self.AFTER)
+
+    def _split(self, words):
+        """
+        VADER's words of the words of a text: single characters are dropped, and a mark of its PUNC_LIST at the
+        start or end of a word is stripped if what is left is at least two characters without punctuation.
+        SentiText does the same through a table of every word of the text with every mark, which takes far
+        more memory than the text
+        """
+        kept = []
+        for word in words:
+            if len(word) < 2:
+                continue
+            if word[0] in string.punctuation or word[-1] in string.punctuation:
+                rest = word.lstrip(string.punctuation)
+                mark = word[:len(word) - len(rest)]
+                if not mark:
+                    rest = word.rstrip(string.punctuation)
+                    mark = word[len(rest):]
+                if mark in self.constants.PUNC_LIST and len(rest) > 1 \
+                        and not self.constants.REGEX_REMOVE_PUNCTUATION.search(rest):
+                    word = rest
+            kept.append(word)
+        return kept
+
+    def _score(self, end):
+        """ score the words up to end, then drop all but the last BEFORE scored words """
+        for i in range(self.scored, end):
+            self._valence(i)
+        cut = max(end - self.BEFORE, 0)
+        del self.words[:cut]
+        self.scored = max(end, self.scored) - cut
+
+    def _valence(self, i):
+        """ add the valence of the i-th held word to the sums """
+        item = self.words[i]
+        lower = item.lower()
+        if item in self.seen:
+            valence = self.seen[item]
+        elif lower not in self.analyzer.lexicon:
+            valence = 0
+        elif (i < len(self.words) - 1 and lower == 'kind' and self.words[i + 1].lower() == 'of') \
+                or lower in self.constants.BOOSTER_DICT:
+            valence = self.seen[item] = 0
+        else:
+            valence = self.seen[item] = self.analyzer.sentiment_valence(0, self, item, i, [])[-1]
+
+        if self.but is None and lower == 'but':
+            self.but = True
+            sums = self.sums[1]
+        else:
+            sums = self.sums[0 if self.but is None else 2]
+
+        if valence > 0:
+            sums[0] += valence
+            sums[1] += 1
+        elif valence < 0:
+            sums[2] += valence
+            sums[3] += 1
+        else:
+            sums[4] += 1
+
+    @property
+    def words_and_emoticons(self):
+        # sentiment_valence reads the words around the item from here
+        return self.words
+
+    def close(self):
+        """
+        :return: dict {neg, neu, pos, compound} as from polarity_scores
+        """
+        self._score(len(self.words))
+        weights = (0.5, 1.0, 1.5) if self.but else (1.0, 1.0, 1.0)
+
+        # the positive and negative sums count each word's valence plus (or minus) one
+        sum_s = sum(w * (sums[0] + sums[2]) for w, sums in zip(weights, self.sums))
+        pos_sum = sum(w * sums[0] + sums[1] for w, sums in zip(weights, self.sums))
+        neg_sum = sum(w * sums[2] - sums[3] for w, sums in zip(weights, self.sums))
+        neu_count = sum(sums[4] for sums in self.sums)
+
+        total = pos_sum + abs(neg_sum) + neu_count
+        if not total:
+            return {'neg': 0.0, 'neu': 0.0, 'pos': 0.0, 'compound': 0.0}
+        return {'neg': round(abs(neg_sum / total), 3), 'neu': round(abs(neu_count / total), 3),
+                'pos': round(abs(pos_sum / total), 3), 'compound': round(self.constants.normalize(sum_s), 4)}
+
+
+class SentimentEngine:
+    """
+    Holds a single VADER analyzer so its lexicon is loaded only once per process
+    """
+
+    def __init__(self):
+        self._analyzer = None
+
+    @property
+    def analyzer(self):
+        if self._analyzer is None:
+            # importing nltk and loading the VADER lexicon takes seconds, so wait until something is scored
+            from nltk.sentiment import SentimentIntensityAnalyzer
+            self._analyzer = SentimentIntensityAnalyzer()
+        return self._analyzer
+
+    def polarity_scores(self, text):
+        """
+        Score a piece of text
+        :param text: str; text to score
+        :return: dict {neg, neu, pos, compound}
+        """
+        return self.analyzer.polarity_scores(text)
+
+    def score(self, sentence):
+        """
+        Score one sentence
+        :param sentence: str
+        :return: (number of tokens, list of the SCORES); sentences without tokens are not scored
+        """
+        count = len(sentence.split())
+        if not count:
+            return 0, [0.0] * len(SCORES)
+
+        polarity = self.polarity_scores(sentence)
+        return count, [polarity[name] for name in SCORES]
+
+    def polarity_stream(self):
+        """
+        :return: PolarityStream giving the polarity_scores of a text fed in pieces
+        """
+        return PolarityStream(self.analyzer)
+
+    def profile(self, sentences):
+        """
+        Score each sentence once and summarize the document
+        :param sentences: list of sentences (str)
+        :return: SentimentProfile
+        """
+        counts = np.zeros(len(sentences), dtype=np.int64)
+        scores = np.zeros((len(sentences), len(SCORES)))
+
+        for i, sentence in enumerate(sentences):
+            counts[i], scores[i] = self.score(sentence)
+
+        return SentimentProfile(counts, scores)
+
+    def profile_words(self, words, window=25):
+        """
+        Score text with no sentence boundaries in fixed windows of words
+        :param words: list of words
+        :param window: int; number of words scored together
+        :return: SentimentProfile
+        """
+        return self.profile([' '.join(words[i:i + window]) for i in range(0, len(words), window)])
+
+
+_engine = SentimentEngine()
+
+
+def get_engine():
+    """
+    :return: the SentimentEngine shared by the whole process
+    """
+    return _engine
@@ -0,0 +1,306 @@
+"""
+service.py: watch a folder for Zoom transcripts and keep corpus statistics up to date
+
+Usage:
+    python service.py incoming/ --speaker "john rachlin" --port 8765
+    curl http://127.0.0.1:8765/state
+
+The folder is polled; a new or changed transcript is parsed in a worker process (the same
+default parsing as ZoomTranscript.load_text) once its size and modification time are stable
+across two polls, and merged into the running aggregates. At most one transcript per worker is
+submitted at a time, so the timeout only counts parsing: a parse that runs past it has its worker
+killed and the pool restarted (other parses cut short by the restart are retried). The ingest
+latency of every file and the time it waited for a free worker are reported.
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fnmatch
+import json
+import os
+import time
+import numpy as np
+from transcripts import ZoomTranscript
+from wordie import _parse_worker
+
+
+class WatchService:
+    """
+    Polls a directory, ingests new and changed transcripts, and serves the aggregates as JSON over HTTP
+    """
+
+    def __init__(self, directory, speaker=None, pattern='*.txt', interval=2.0, workers=None, timeout=60.0,
+                 host='127.0.0.1', port=8765, stopfile=None, cache=None):
+        """
+        :param directory: str; folder to watch
+        :param speaker: str; speaker to analyse (default everyone)
+        :param pattern: str; file name pattern of transcripts
+        :param interval: float; seconds between polls
+        :param workers: int; number of worker processes parsing transcripts
+        :param timeout: float; seconds a single transcript may take to parse before it is reported as failed
+        :param host: str; address of the JSON endpoint
+        :param port: int; port of the JSON endpoint (None to disable it)
+        :param stopfile: file to remove stop words by
+        :param cache: optional ParseCache (or a directory for one)
+        """
+        self.directory = directory
+        self.pattern = pattern
+        self.interval = interval
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.host, self.port = host, port
+
+        self.kwargs = {'speaker': speaker} if speaker else {}
+        if stopfile:
+            self.kwargs['stopfile'] = stopfile
+
+        self.corpus = ZoomTranscript(cache=cache)
+
+        # file signatures (modification time, size): ingested, and waiting to settle
+        self.ingested = {}
+        self.pending = {}
+
+        # running aggregates
+        self.sentence_hist = np.zeros(0, dtype=np.int64)
+        self.latencies = []
+        self.waits = []
+        self.failed = {}
+        self.started = time.time()
+
+        self._stop = asyncio.Event()
+        self._pool = None
+        self._slots = None
+
+    def _scan(self):
+        """ {path: (mtime, size)} of every transcript in the directory """
+        found = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern):
+                stat = entry.stat()
+                found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    @staticmethod
+    def _label(path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def _add_hist(self, hist, sign=1):
+        """ add (or take out) a meeting's sentence length histogram from the corpus histogram """
+        if len(hist) > len(self.sentence_hist):
+            self.sentence_hist = np.concatenate([self.sentence_hist,
+                                                 np.zeros(len(hist) - len(self.sentence_hist), dtype=np.int64)])
+        self.sentence_hist[:len(hist)] += sign * np.asarray(hist, dtype=np.int64)
+
+    def _remove(self, label):
+        """ take a meeting out of the corpus and the aggregates """
+        if label in self.corpus.data['sentence_hist']:
+            self._add_hist(self.corpus.data['sentence_hist'][label], -1)
+        self.corpus.remove_text(label)
+
+    def _recycle(self, pool):
+        """ kill the workers of a pool (a running parse cannot be cancelled) and start a new pool """
+        if pool is not self._pool:
+            return
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def _parse(self, path):
+        """
+        Parse a transcript in the worker pool, restarting the pool if the parse times out
+        :param path: str; transcript to parse
+        :return: results dict
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            pool = self._pool
+            try:
+                results, _ = await asyncio.wait_for(
+                    loop.run_in_executor(pool, _parse_worker, type(self.corpus), path, None, self.kwargs),
+                    self.timeout)
+                return results
+            except asyncio.TimeoutError:
+                self._recycle(pool)
+                raise
+            except BrokenProcessPool:
+                # cut short when another parse timed out and its pool was restarted: try again
+                if pool is self._pool:
+                    raise
+
+    async def ingest(self, path, detected):
+        """
+        Parse one transcript in the worker pool and merge it into the corpus
+        :param path: str; transcript to parse
+        :param detected: float; perf_counter time the change was first seen
+        :return: none
+        """
+        label = self._label(path)
+
+        try:
+            key = self.corpus._cache_key(path, **self.kwargs)
+            results = self.corpus.cache.get(key) if key else None
+            if results is None:
+                # wait for a free worker, so the timeout starts when the parse does
+                queued = time.perf_counter()
+                async with self._slots:
+                    self.waits.append(time.perf_counter() - queued)
+                    results = await self._parse(path)
+                if key:
+                    self.corpus.cache.put(key, results)
+        except asyncio.TimeoutError:
+            self.failed[path] = f'timed out after {self.timeout}s'
+            return
+        except Exception as e:
+            self.failed[path] = str(e)
+            return
+
+        # replacing a meeting takes its old numbers out of the aggregates first
+        if label in self.corpus.data['wordcount']:
+            self._remove(label)
+        self.corpus._save_results(label, results)
+        self._add_hist(results['sentence_hist'])
+
+        self.failed.pop(path, None)
+        self.latencies.append(time.perf_counter() - detected)
+
+    async def poll(self):
+        """
+        Scan the directory once and ingest every transcript that changed and has settled
+        :return: none
+        """
+        loop = asyncio.get_running_loop()
+        found = await loop.run_in_executor(None, self._scan)
+        now = time.perf_counter()
+
+        # transcripts that disappeared leave the corpus
+        for path in list(self.ingested):
+            if path not in found:
+                del self.ingested[path]
+                self._remove(self._label(path))
+
+        ready = []
+        for path, signature in found.items():
+            if self.ingested.get(path) == signature:
+                continue
+
+            # a file still being written changes between polls; wait until it settles
+            previous = self.pending.get(path)
+            if previous is not None and previous[0] == signature:
+                ready.append((path, previous[1]))
+                del self.pending[path]
+                self.ingested[path] = signature
+            else:
+                self.pending[path] = (signature, previous[1] if previous else now)
+
+        await asyncio.gather(*(self.ingest(path, detected) for path, detected in ready))
+
+    def state(self):
+        """
+        :return: json serializable snapshot of the corpus aggregates and ingest latency
+        """
+        latencies = np.asarray(self.latencies)
+        waits = np.asarray(self.waits)
+        return {
+            'directory': self.directory,
+            'uptime': round(time.time() - self.started, 1),
+            'meetings': len(self.corpus.data['numwords']),
+            'numwords': int(sum(self.corpus.data['numwords'].values())),
+            'top_words': self.corpus.index.top_k(25),
+            'sentiment': dict(self.corpus.data['sentiment']),
+            'sentence_stats': {'corpus': self.corpus.hist_stats(self.sentence_hist),
+                               'meetings': dict(self.corpus.data['sentence_stats'])},
+            'latency': {
+                'files': len(latencies),
+                'last': float(latencies[-1]) if len(latencies) else None,
+                'mean': float(latencies.mean()) if len(latencies) else None,
+                'max': float(latencies.max()) if len(latencies) else None,
+                # settling (two polls) plus parsing; the wait for a free worker comes on top
+                'bound': self.timeout + 2 * self.interval
+            },
+            'queue_wait': {
+                'mean': float(waits.mean()) if len(waits) else None,
+                'max': float(waits.max()) if len(waits) else None
+            },
+            'pending': sorted(self.pending),
+            'failed': self.failed
+        }
+
+    async def _handle(self, reader, writer):
+        """ answer GET /state (or /) with the current state as JSON """
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request.decode(errors='replace').split()
+            path = parts[1] if len(parts) > 1 else '/'
+            if path in ('/', '/state'):
+                status, body = '200 OK', json.dumps(self.state())
+            else:
+                status, body = '404 Not Found', json.dumps({'error': f'no such endpoint {path}'})
+
+            body = body.encode()
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def run(self):
+        """
+        Serve the endpoint and poll the directory until stop() is called
+        :return: none
+        """
+        self._stop.clear()
+        server = None
+        if self.port is not None:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._slots = asyncio.Semaphore(self.workers)
+        try:
+            while not self._stop.is_set():
+                await self.poll()
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # the pool may have been restarted, so it is shut down here rather than by a with block
+            self._pool.shutdown()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch a folder of Zoom transcripts and serve live statistics')
+    parser.add_argument('directory')
+    parser.add_argument('--speaker', help='speaker to analyse (default: everyone)')
+    parser.add_argument('--pattern', default='*.txt')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between polls')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds allowed to parse one transcript')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--stopfile')
+    parser.add_argument('--cache', help='directory of the parse cache')
+    args = parser.parse_args()
+
+    service = WatchService(args.directory, args.speaker, args.pattern, args.interval, args.workers, args.timeout,
+                           args.host, args.port, args.stopfile, args.cache)
+    print(f'watching {args.directory}, state at http://{args.host}:{args.port}/state')
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
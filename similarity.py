@@ -0,0 +1,155 @@
+"""
+similarity.py: cross-document similarity for Wordie
+
+TF-IDF cosine similarity is one sparse matrix product over the document-term matrix.
+Near-duplicate detection uses MinHash signatures of each document's shingles, bucketed
+by locality-sensitive hashing so only documents sharing a bucket are compared.
+"""
+
+from collections import defaultdict
+import zlib
+import numpy as np
+
+# MinHash permutations are (a * x + b) mod a Mersenne prime; with 31 bits the products fit in uint64
+MERSENNE = (1 << 31) - 1
+
+
+def count_matrix(wordcounts):
+    """
+    Build a sparse document-term matrix from per-document counts
+    :param wordcounts: dict {label: {word: count}}
+    :return: (list of labels, list of words, scipy.sparse CSR matrix with one row per label and one column per word)
+    """
+    from scipy import sparse
+
+    vocab = {}
+    indptr, indices, data = [0], [], []
+    for counts in wordcounts.values():
+        indices.extend(vocab.setdefault(word, len(vocab)) for word in counts)
+        data.extend(counts.values())
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix((np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int64),
+                                np.asarray(indptr, dtype=np.int64)), shape=(len(wordcounts), len(vocab)))
+    return list(wordcounts), list(vocab), matrix
+
+
+def tfidf(matrix):
+    """
+    Weight a count matrix by TF-IDF (smoothed idf) and scale every row to unit length
+    :param matrix: scipy.sparse matrix of counts, one row per document
+    :return: scipy.sparse CSR matrix
+    """
+    from scipy import sparse
+
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    n = matrix.shape[0]
+
+    # number of documents containing each word
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + n) / (1 + df)) + 1
+
+    weighted = matrix @ sparse.diags(idf)
+    return normalize(weighted)
+
+
+def normalize(matrix):
+    """
+    :param matrix: scipy.sparse matrix
+    :return: CSR matrix with every non-empty row scaled to unit (L2) length
+    """
+    from scipy import sparse
+
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return sparse.diags(scale) @ matrix
+
+
+def cosine_similarity(matrix, weighting='tfidf'):
+    """
+    Cosine similarity of every pair of documents
+    :param matrix: scipy.sparse matrix of counts, one row per document
+    :param weighting: str; 'tfidf' or 'count' (raw counts)
+    :return: dense (documents x documents) array
+    """
+    if weighting not in ('tfidf', 'count'):
+        raise ValueError(f'unknown weighting {weighting!r}')
+
+    rows = tfidf(matrix) if weighting == 'tfidf' else normalize(matrix)
+    return (rows @ rows.T).toarray()
+
+
+class MinHasher:
+    """
+    MinHash signatures of sets of strings; the share of equal signature entries
+    estimates the Jaccard similarity of two sets
+    """
+
+    def __init__(self, num_perm=128, seed=1):
+        """
+        :param num_perm: int; number of hash permutations (signature length)
+        :param seed: int; seed of the permutations (signatures are only comparable with the same seed)
+        """
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, MERSENNE, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE, num_perm, dtype=np.uint64)
+
+    def signature(self, shingles):
+        """
+        :param shingles: iterable of strings
+        :return: uint32 array of num_perm minimum hashes (all MERSENNE for an empty set)
+        """
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64) % MERSENNE
+        if not len(hashes):
+            return np.full(self.num_perm, MERSENNE, dtype=np.uint32)
+
+        permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    Choose how to split signatures into bands so pairs around the threshold become candidates
+    :param num_perm: int; signature length
+    :param threshold: float; Jaccard similarity of interest
+    :return: (bands, rows per band) with bands * rows <= num_perm
+    """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm // rows > 0]
+
+    # the probability of becoming a candidate rises steeply around (1 / bands) ** (1 / rows)
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+def near_duplicates(signatures, threshold=0.8):
+    """
+    Find pairs of documents whose estimated Jaccard similarity reaches the threshold,
+    comparing only documents that share an LSH bucket
+    :param signatures: dict {label: MinHash signature}, all of the same length
+    :param threshold: float; smallest estimated Jaccard similarity reported
+    :return: list of (label, label, estimated similarity), most similar first
+    """
+    if not signatures:
+        return []
+
+    labels = list(signatures)
+    stacked = np.vstack([signatures[label] for label in labels])
+    bands, rows = lsh_bands(stacked.shape[1], threshold)
+
+    # documents whose signatures agree on a whole band land in the same bucket
+    candidates = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for i, key in enumerate(map(bytes, stacked[:, band * rows:(band + 1) * rows])):
+            buckets[key].append(i)
+        for members in buckets.values():
+            candidates.update((members[x], members[y]) for x in range(len(members))
+                              for y in range(x + 1, len(members)))
+
+    pairs = []
+    for i, j in candidates:
+        similarity = float(np.mean(stacked[i] == stacked[j]))
+        if similarity >= threshold:
+            pairs.append((labels[i], labels[j], round(similarity, 4)))
+    return sorted(pairs, key=lambda pair: (-pair[2], pair[0], pair[1]))
@@ -0,0 +1,358 @@
+"""
+snapshot.py: save a loaded corpus to disk and reopen it without re-parsing
+
+A snapshot is a directory with meta.json (labels, settings and the layout of every field)
+and one .npy file per column. Numeric fields are stored as flat arrays, per-document arrays
+and word counts as concatenated values with offsets, and texts as one utf-8 blob. Columns are
+memory-mapped when the snapshot is opened, and each field is only read into the document
+records the first time it is looked up. Files are written under a temporary name and then renamed,
+so a corpus opened from a snapshot can be saved over it: its maps keep the old files.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+import json
+import os
+import pickle
+import tempfile
+import numpy as np
+from corpus import CorpusIndex
+from ngrams import PhraseIndex
+from records import DocumentRecord
+from search import PositionalIndex
+from sentiment import SentimentProfile
+
+FORMAT_VERSION = 1
+
+META = 'meta.json'
+
+# how each statistic of the default parsers is laid out; anything else is pickled
+KINDS = {
+    'plain_text': 'text',
+    'wordcount': 'counts',
+    'numwords': 'number',
+    'phrases': 'phrases',
+    'sentiment': 'dict',
+    'sentiment_profile': 'profile',
+    'sentence_length': 'array',
+    'sentence_hist': 'array',
+    'sentence_stats': 'dict',
+    'turn_start': 'array',
+    'turn_end': 'array',
+    'turn_words': 'array',
+    'turn_sentiment': 'array'
+}
+
+
+def _ragged(arrays, dtype=None):
+    """ concatenate arrays into (values, offsets) """
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    values = np.concatenate(arrays) if arrays else np.zeros(0)
+    return (values.astype(dtype) if dtype else values), offsets
+
+
+def _split(values, offsets):
+    """ views of each document's slice of concatenated values """
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def _encode_counts(counters, vocab, words):
+    """ (ids, counts, offsets) of a list of Counters, growing the shared vocabulary """
+    ids, counts, offsets = [], [], [0]
+    for counter in counters:
+        for word in counter:
+            if word not in vocab:
+                vocab[word] = len(words)
+                words.append(word)
+        ids.extend(vocab[word] for word in counter)
+        counts.extend(counter.values())
+        offsets.append(len(ids))
+    return np.asarray(ids, dtype=np.int32), np.asarray(counts, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+
+@contextmanager
+def _replacing(path, mode='wb'):
+    """ write a file under a temporary name and move it over path once it is complete """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class _Writer:
+    """ writes the columns of one snapshot directory """
+
+    def __init__(self, path):
+        self.path = path
+
+    def open(self, name, mode='wb'):
+        return _replacing(os.path.join(self.path, name), mode)
+
+    def array(self, name, values):
+        with self.open(name + '.npy') as f:
+            np.save(f, np.ascontiguousarray(values))
+
+    def field(self, stat, values):
+        """
+        Write one statistic of the listed documents
+        :param stat: str; name of the statistic
+        :param values: list of its values, one per document that has it
+        :return: dict describing the layout (stored in meta.json)
+        """
+        kind = KINDS.get(stat, 'pickle')
+        layout = {'kind': kind}
+
+        if kind == 'number':
+            self.array(stat, np.asarray(values))
+        elif kind == 'dict':
+            keys = list(values[0])
+            layout['keys'] = keys
+            layout['ints'] = [key for key in keys if isinstance(values[0][key], (int, np.integer))]
+            self.array(stat, np.array([[value[key] for key in keys] for value in values], dtype=np.float64))
+        elif kind == 'array':
+            arrays = [np.asarray(value) for value in values]
+            stored, offsets = _ragged(arrays, arrays[0].dtype)
+            self.array(stat, stored)
+            self.array(stat + '.offsets', offsets)
+        elif kind == 'profile':
+            tokens, offsets = _ragged([profile.tokens for profile in values], np.int64)
+            self.array(stat + '.tokens', tokens)
+            self.array(stat + '.weighted', np.concatenate([profile.weighted for profile in values]))
+            self.array(stat + '.offsets', offsets)
+        elif kind == 'text':
+            encoded = [text.encode() for text in values]
+            offsets = np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64)
+            with self.open(stat + '.bin') as f:
+                f.write(b''.join(encoded))
+            self.array(stat + '.offsets', offsets)
+        elif kind == 'counts':
+            vocab, words = {}, []
+            ids, counts, offsets = _encode_counts(values, vocab, words)
+            self.counts(stat, words, ids, counts, offsets)
+        elif kind == 'phrases':
+            layout['sizes'] = sorted({n for value in values for n in value})
+            for n in layout['sizes']:
+                vocab, words = {}, []
+                ids, counts, offsets = _encode_counts([value.get(n, {}) for value in values], vocab, words)
+                self.counts(f'{stat}.{n}', words, ids, counts, offsets)
+        else:
+            with self.open(stat + '.pkl') as f:
+                pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        return layout
+
+    def counts(self, name, words, ids, counts, offsets):
+        """ vocabulary plus CSR-style (ids, counts, offsets) columns """
+        with self.open(name + '.vocab.json', 'w') as f:
+            json.dump(words, f)
+        self.array(name + '.ids', ids)
+        self.array(name + '.counts', counts.astype(np.int32))
+        self.array(name + '.offsets', offsets)
+
+
+def save_snapshot(wordie, path):
+    """
+    Write the corpus state of a Wordie object to a snapshot directory
+    :param wordie: Wordie (or subclass) to save
+    :param path: str; directory to write (created if missing, existing columns are replaced)
+    :return: none
+    """
+    os.makedirs(path, exist_ok=True)
+    writer = _Writer(path)
+
+    # a corpus opened from this snapshot reads its pending fields and indexes before their files are replaced
+    for stat in list(wordie.data.pending):
+        wordie.data[stat]
+    wordie.phrases, wordie.postings
+    labels = list(wordie.records)
+    position = {label: i for i, label in enumerate(labels)}
+
+    fields = {}
+    for stat in list(wordie.data):
+        column = wordie.data[stat]
+        present = [label for label in labels if label in column]
+        if not present:
+            continue
+
+        # documents that have the field, as positions in the label list
+        writer.array(stat + '.rows', np.array([position[label] for label in present], dtype=np.int64))
+        fields[stat] = writer.field(stat, [column[label] for label in present])
+
+    # corpus phrase counts are saved as they are (documents may not keep their phrases)
+    phrases = {'mode': wordie.phrases.mode, 'sizes': list(wordie.phrases.sizes), 'keep': wordie.phrases.keep}
+    if wordie.phrases.mode == 'exact':
+        for n, counts in wordie.phrases.counts.items():
+            words = list(counts.counts)
+            writer.counts(f'phrase_totals.{n}', words, np.arange(len(words), dtype=np.int32),
+                          np.fromiter(counts.counts.values(), dtype=np.int64, count=len(words)),
+                          np.array([0, len(words)], dtype=np.int64))
+    else:
+        phrases['sketches'] = {}
+        for n, counts in wordie.phrases.counts.items():
+            writer.array(f'sketch.{n}', counts.sketch.table)
+            phrases['sketches'][n] = {'capacity': counts.capacity, 'candidates': list(counts.candidates.items())}
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'class': type(wordie).__name__,
+        'backend': wordie.backend,
+        'keep': None if wordie.keep is None else sorted(wordie.keep),
+        'labels': labels,
+        'fields': fields,
+        'phrases': phrases
+    }
+    with writer.open(META, 'w') as f:
+        json.dump(meta, f)
+
+
+class _Reader:
+    """ reads the columns of one snapshot directory, memory-mapped """
+
+    def __init__(self, path):
+        self.path = path
+
+    def array(self, name, mmap=True):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r' if mmap else None)
+
+    def counts(self, name):
+        """ (vocabulary, ids, counts, offsets) of a counts column """
+        with open(os.path.join(self.path, name + '.vocab.json')) as f:
+            words = json.load(f)
+        return words, self.array(name + '.ids'), self.array(name + '.counts'), self.array(name + '.offsets')
+
+    def values(self, stat, layout):
+        """
+        Decode one statistic
+        :param stat: str; name of the statistic
+        :param layout: dict from meta.json
+        :return: list of values, one per row of the field
+        """
+        kind = layout['kind']
+
+        if kind == 'number':
+            return self.array(stat).tolist()
+        if kind == 'dict':
+            ints = set(layout['ints'])
+            return [{key: int(value) if key in ints else value for key, value in zip(layout['keys'], row)}
+                    for row in self.array(stat).tolist()]
+        if kind == 'array':
+            return _split(self.array(stat), self.array(stat + '.offsets'))
+        if kind == 'profile':
+            offsets = self.array(stat + '.offsets')
+            tokens, weighted = self.array(stat + '.tokens'), self.array(stat + '.weighted')
+            return [SentimentProfile.from_sums(t, w) for t, w in zip(_split(tokens, offsets), _split(weighted, offsets))]
+        if kind == 'text':
+            blob = np.memmap(os.path.join(self.path, stat + '.bin'), dtype=np.uint8, mode='r') \
+                if os.path.getsize(os.path.join(self.path, stat + '.bin')) else np.zeros(0, np.uint8)
+            offsets = self.array(stat + '.offsets').tolist()
+            return [blob[offsets[i]:offsets[i + 1]].tobytes().decode() for i in range(len(offsets) - 1)]
+        if kind == 'counts':
+            return self.counters(stat)
+        if kind == 'phrases':
+            values = None
+            for n in layout['sizes']:
+                counters = self.counters(f'{stat}.{n}')
+                values = values or [{} for _ in counters]
+                for value, counter in zip(values, counters):
+                    value[n] = counter
+            return values
+
+        with open(os.path.join(self.path, stat + '.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def counters(self, name):
+        """ one Counter per row of a counts column """
+        words, ids, counts, offsets = self.counts(name)
+        ids, counts, offsets = ids.tolist(), counts.tolist(), offsets.tolist()
+        return [Counter(dict(zip([words[i] for i in ids[a:b]], counts[a:b])))
+                for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def load_snapshot(cls, path, **kwargs):
+    """
+    Reopen a snapshot; every field stays on disk until it is first looked up
+    :param cls: Wordie class (or subclass) to create
+    :param path: str; snapshot directory written by save_snapshot
+    :param kwargs: other arguments for the class (e.g. cache, profiler)
+    :return: Wordie object
+    """
+    with open(os.path.join(path, META)) as f:
+        meta = json.load(f)
+    if meta['format'] != FORMAT_VERSION:
+        raise ValueError(f"snapshot format {meta['format']} is not supported (expected {FORMAT_VERSION})")
+
+    reader = _Reader(path)
+    settings = meta['phrases']
+    wordie = cls(backend=meta['backend'], keep=meta['keep'],
+                 phrases=PhraseIndex(settings['mode'], settings['sizes'], keep=settings['keep']), **kwargs)
+
+    labels = meta['labels']
+    records = [DocumentRecord() for _ in labels]
+    wordie.records.update(zip(labels, records))
+
+    def loader(stat, layout):
+        def load():
+            # write into the record objects, so documents removed in the meantime are left alone
+            rows = reader.array(stat + '.rows').tolist()
+            for row, value in zip(rows, reader.values(stat, layout)):
+                records[row].set(stat, value)
+        return load
+
+    # word counts also feed the corpus totals
+    if 'wordcount' in meta['fields']:
+        words, ids, counts, offsets = reader.counts('wordcount')
+        totals = np.bincount(ids, weights=counts, minlength=len(words)).astype(np.int64)
+        rows = reader.array('wordcount.rows').tolist()
+
+        if wordie.backend == 'sparse':
+            matrix = wordie.index
+            matrix.vocab = {word: i for i, word in enumerate(words)}
+            matrix.words = words
+            matrix.totals = totals
+            matrix._rows = {labels[row]: (ids[a:b], counts[a:b])
+                            for row, a, b in zip(rows, offsets[:-1].tolist(), offsets[1:].tolist())}
+        else:
+            wordie.index = CorpusIndex()
+            wordie.index.counts = Counter({word: total for word, total in zip(words, totals.tolist()) if total})
+
+    # the sparse backend serves word counts from the matrix, everything else is read on first use
+    for stat, layout in meta['fields'].items():
+        if stat != 'wordcount' or wordie.backend == 'dict':
+            wordie.data.pending[stat] = loader(stat, layout)
+
+    # the phrase and search indexes are rebuilt from the documents the first time they are used
+    wordie._deferred = {'phrases': lambda: _phrase_index(wordie, reader, settings),
+                        'postings': lambda: _postings(wordie)}
+    del wordie.phrases, wordie.postings
+    return wordie
+
+
+def _phrase_index(wordie, reader, settings):
+    """ PhraseIndex of a reopened snapshot """
+    phrases = PhraseIndex(settings['mode'], settings['sizes'], keep=settings['keep'])
+    if settings['mode'] == 'exact':
+        for n, counts in phrases.counts.items():
+            words, _, totals, _ = reader.counts(f'phrase_totals.{n}')
+            counts.counts = Counter(dict(zip(words, totals.tolist())))
+    else:
+        for n, sketch in settings['sketches'].items():
+            counts = phrases.counts[int(n)]
+            table = reader.array(f'sketch.{n}', mmap=False)
+            counts.sketch.table = table
+            counts.sketch.depth, counts.sketch.width = table.shape
+            counts.capacity = sketch['capacity']
+            counts.candidates = dict((phrase, estimate) for phrase, estimate in sketch['candidates'])
+    return phrases
+
+
+def _postings(wordie):
+    """ PositionalIndex of a reopened snapshot """
+    postings = PositionalIndex()
+    for label, text in wordie.data['plain_text'].items():
+        postings.add(label, text.split(), wordie.data['turn_words'].get(label), wordie.data['turn_start'].get(label))
+    return postings
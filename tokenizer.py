@@ -0,0 +1,97 @@
+"""
+tokenizer.py: word tokenizing and stop word removal shared by every document of a corpus
+
+A Tokenizer holds its stop words in a frozenset and remembers, for every distinct word it has
+seen, whether the word is kept, so the stop word test runs once per vocabulary entry instead of
+once per token. Tokenizers are built once per process for each stop word list (see get_tokenizer).
+"""
+
+from collections import Counter
+import os
+
+# removes all punctuation except apostrophes (for clarity with contractions)
+PUNCTUATION = str.maketrans('', '', '''!()-[]{};:"\\,<>./?@#$%^&*_~''')
+
+
+class Tokenizer:
+    """
+    Splits lowercased text into words and sentences and removes stop words
+    """
+
+    def __init__(self, stop_words=()):
+        """
+        :param stop_words: iterable of stop words; a word is dropped if it (or the part before its first
+                           apostrophe) is one of them
+        """
+        self.stop_words = frozenset(stop_words)
+        self._kept = {}
+
+    def keeps(self, word):
+        """
+        :param word: str; a token
+        :return: whether the word is not a stop word
+        """
+        kept = self._kept.get(word)
+        if kept is None:
+            kept = self._kept[word] = word.split('\'')[0] not in self.stop_words
+        return kept
+
+    def filter(self, words):
+        """
+        Remove stop words, testing each distinct word only once
+        :param words: list of words
+        :return: (list of the remaining words in order, Counter of them)
+        """
+        counts = Counter(words)
+        dropped = {word for word in counts if not self.keeps(word)}
+        if not dropped:
+            return words, counts
+
+        for word in dropped:
+            del counts[word]
+        return [word for word in words if word not in dropped], counts
+
+    def tokenize(self, text):
+        """
+        Everything the default parsers take from the text of a document
+        :param text: str; lowercased text
+        :return: (plain text without punctuation, list of sentences, number of words,
+                  list of words without stop words, Counter of them)
+        """
+        sentences = text.split('.')
+        plain = text.translate(PUNCTUATION)
+        words = plain.split()
+        kept, counts = self.filter(words)
+        return plain, sentences, len(words), kept, counts
+
+
+def read_stop_words(stopfile=None):
+    """
+    :param stopfile: optional file of stop words separated by whitespace (default NLTK's English list)
+    :return: list of stop words
+    """
+    if stopfile:
+        with open(stopfile) as f:
+            return f.read().lower().split()
+
+    # default list
+    from nltk.corpus import stopwords as sw
+    return sw.words('english')
+
+
+_tokenizers = {}
+
+
+def get_tokenizer(stopfile=None):
+    """
+    :param stopfile: optional file of stop words (default NLTK's English list)
+    :return: the Tokenizer of this process for the stop word list, rebuilt only if the file changed
+    """
+    key = None
+    if stopfile:
+        stat = os.stat(stopfile)
+        key = (os.path.abspath(stopfile), stat.st_mtime_ns, stat.st_size)
+
+    if key not in _tokenizers:
+        _tokenizers[key] = Tokenizer(read_stop_words(stopfile))
+    return _tokenizers[key]
@@ -2,10 +2,111 @@
 Transcript Class
 02/24/2023
 """
-from wordie import Wordie
-from collections import defaultdict, Counter
-from nltk.sentiment import SentimentIntensityAnalyzer
-from nltk.corpus import stopwords as sw
+from wordie import Wordie, TextStream, PUNCTUATION
+from tokenizer import get_tokenizer
+from validation import TIMESTAMP, open_document
+from array import array
+from collections import namedtuple
+from contextlib import nullcontext
+import os
+import numpy as np
+
+# one speaker turn of a transcript: lowercased speaker name, start time in seconds, lowercased text
+Turn = namedtuple('Turn', ['speaker', 'start', 'text'])
+
+
+def to_seconds(timestamp):
+    """
+    Convert a HH:MM:SS timestamp to seconds
+    :param timestamp: str; timestamp from the transcript
+    :return: int; number of seconds since the start of the meeting
+    """
+    hours, minutes, seconds = timestamp.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+class TurnStream:
+    """
+    Streamed statistics of a document made of speaker turns: a TextStream of the turn texts (joined by spaces)
+    plus running counts for each turn
+    """
+
+    def __init__(self, tokenizer, chunk_size=1 << 16):
+        """
+        :param tokenizer: Tokenizer removing the stop words
+        :param chunk_size: int; characters collected before they are passed on to the TextStream
+        """
+        self.text = TextStream(tokenizer)
+        self.turns, self.words, self.tokens, self.spoken = array('i'), array('i'), array('q'), array('q')
+        self.new_turn = True
+
+        # lines are passed on in chunks rather than one at a time
+        self.chunk_size = chunk_size
+        self.buffer, self.buffered = [], 0
+
+    def _feed(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.chunk_size:
+            self.text.feed(''.join(self.buffer))
+            self.buffer, self.buffered = [], 0
+
+    def start_turn(self, index):
+        """
+        :param index: int; position of the turn among every turn of the transcript
+        :return: none
+        """
+        if self.turns:
+            self._feed(' ')
+        self.turns.append(index)
+        self.words.append(0)
+        self.tokens.append(0)
+        self.spoken.append(0)
+        self.new_turn = True
+
+    def line(self, text):
+        """
+        :param text: str; next line of the current turn (stripped and lowercased)
+        :return: none
+        """
+        if not self.new_turn:
+            self._feed(' ')
+        self._feed(text)
+        self.new_turn = False
+
+        # the same counts _turn_results takes from whole turns
+        self.words[-1] += len(text.translate(PUNCTUATION).split())
+        self.tokens[-1] += len(text.replace('.', ' ').split())
+        self.spoken[-1] += len(text.split())
+
+    def close(self, starts):
+        """
+        :param starts: list of the start time (seconds or None) of every turn of the transcript
+        :return: (results dict as from ZoomTranscript._turn_results without plain_text and sentence_length,
+                 talk statistics)
+        """
+        self.text.feed(''.join(self.buffer))
+        self.buffer, self.buffered = [], 0
+        results = self.text.close()
+
+        # a turn lasts until the next turn starts, whoever is speaking
+        ends = starts[1:] + [None]
+        start = [starts[i] for i in self.turns]
+        end = [ends[i] for i in self.turns]
+
+        results['turn_start'] = np.array([np.nan if s is None else s for s in start], dtype=np.float64)
+        results['turn_end'] = np.array([np.nan if e is None else e for e in end], dtype=np.float64)
+        results['turn_words'] = np.array(self.words, dtype=np.int32)
+        bounds = np.concatenate([[0], np.cumsum(self.tokens)])
+        results['turn_sentiment'] = results['sentiment_profile'].spans(bounds).astype(np.float32)
+
+        talk = {'words': 0, 'turns': 0, 'speaking_time': 0}
+        for s, e, spoken in zip(start, end, self.spoken):
+            talk['words'] += spoken
+            talk['turns'] += 1
+            if s is not None and e is not None:
+                talk['speaking_time'] += e - s
+        return results, talk
 
 
 class ZoomTranscript(Wordie):
@@ -13,35 +114,105 @@ class ZoomTranscript(Wordie):
     Child class of wordie library. Specific to zoom transcripts
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cache=None, backend='dict', profiler=None, phrases='exact', keep=None):
+        super().__init__(cache, backend, profiler, phrases, keep)
 
     @staticmethod
-    def transcript_reader(filename, speaker, delimiter='user avatar'):
+    def turn_events(filename, delimiter='user avatar'):
         """
-        Zoom transcript specific reader for gathering a specific speaker's words from the meeting
-        :param filename: str; file containing the transcript
-        :param speaker: str; speaker to search for
-        :param delimiter: str; what separates speakers
-        :return: cleaned transcript
+        Walk a Zoom transcript line by line.
+        Each turn is a speaker line and a HH:MM:SS timestamp line followed by the spoken text,
+        and turns are separated by the delimiter line (the first turn may not be preceded by one)
+        :param filename: str; file containing the transcript (or the open file)
+        :param delimiter: str; line that separates speakers
+        :return: generator of ('speaker', name) when a turn starts, ('time', seconds), ('text', line)
+                 and ('end', None) when the turn is over
         """
-        transcript = open(filename).read().lower()
+        delimiter = delimiter.lower()
+        speaker = None
+
+        # what the next non-empty line should be: 'speaker', 'time' or 'text'
+        expect = 'speaker'
+
+        with open(filename) if isinstance(filename, str) else nullcontext(filename) as f:
+            for line in f:
+                line = line.strip().lower()
 
-        # split into sections by speaker
-        sections = transcript.split(delimiter)
+                if line == delimiter:
+                    if speaker is not None:
+                        yield 'end', None
+                    speaker = None
+                    expect = 'speaker'
 
-        cleaned = ''
-        for section in sections:
-            if speaker in section:
-                split = section.split('\n')
+                elif not line:
+                    continue
 
-                # remove timestamp
-                del split[:2]
+                elif expect == 'speaker':
+                    speaker = line
+                    expect = 'time'
+                    yield 'speaker', line
 
-                # add only text from section to cleaned
-                cleaned += ' '.join(map(str, split))
+                elif expect == 'time' and TIMESTAMP.match(line):
+                    expect = 'text'
+                    yield 'time', to_seconds(line)
 
-        return cleaned
+                else:
+                    expect = 'text'
+                    yield 'text', line
+
+        if speaker is not None:
+            yield 'end', None
+
+    @staticmethod
+    def iter_turns(filename, delimiter='user avatar'):
+        """
+        Walk a Zoom transcript, yielding one record per speaker turn
+        :param filename: str; file containing the transcript (or the open file)
+        :param delimiter: str; line that separates speakers
+        :return: generator of Turn(speaker, start, text); start is None if the timestamp is missing
+        """
+        speaker, start, lines = None, None, []
+        for kind, value in ZoomTranscript.turn_events(filename, delimiter):
+            if kind == 'speaker':
+                speaker, start, lines = value, None, []
+            elif kind == 'time':
+                start = value
+            elif kind == 'text':
+                lines.append(value)
+            else:
+                yield Turn(speaker, start, ' '.join(lines))
+
+    @staticmethod
+    def timed_turns(filename, delimiter='user avatar'):
+        """
+        Walk a Zoom transcript, pairing each turn with the time it ends (when the next turn starts)
+        :param filename: str; file containing the transcript (or the open file)
+        :param delimiter: str; line that separates speakers
+        :return: generator of (Turn, end); end is None for the last turn or if a timestamp is missing
+        """
+        previous = None
+        for turn in ZoomTranscript.iter_turns(filename, delimiter):
+            if previous is not None:
+                yield previous, turn.start
+            previous = turn
+
+        if previous is not None:
+            yield previous, None
+
+    @staticmethod
+    def transcript_reader(filename, speaker=None, delimiter='user avatar'):
+        """
+        Zoom transcript specific reader for gathering a specific speaker's words from the meeting
+        :param filename: str; file containing the transcript
+        :param speaker: str; speaker to search for (exact, case insensitive match; default all speakers)
+        :param delimiter: str; what separates speakers
+        :return: cleaned transcript
+        """
+        if speaker is not None:
+            speaker = speaker.strip().lower()
+
+        return ' '.join(turn.text for turn in ZoomTranscript.iter_turns(filename, delimiter)
+                        if speaker is None or turn.speaker == speaker)
 
     def _default_parser(self, transcript, stopfile=None, **kwargs):
         """
@@ -49,32 +220,303 @@ class ZoomTranscript(Wordie):
         :param transcript: str name of the transcript being read
         :param speaker: speaker being searched for
         :param stopfile: file to remove stop words by
+        :param stream: bool; process the transcript line by line so memory does not grow with the file
+                       (the results are the same, but the plain text and the document sentiment are not kept)
         :return: results dict
         """
-        text = self.transcript_reader(transcript, **kwargs)
+        speaker = kwargs.get('speaker')
+        if speaker is not None:
+            speaker = speaker.strip().lower()
+
+        if kwargs.get('stream'):
+            selected = self._stream_turns(transcript, lambda name: 'all' if speaker in (None, name) else None,
+                                          stopfile, kwargs.get('delimiter', 'user avatar'), keys=('all',))
+            return selected['all'][0]
+
+        with self._open(transcript, **kwargs) as f, self._stage('read') as stage:
+            turns = [(turn, end) for turn, end in self.timed_turns(f, kwargs.get('delimiter', 'user avatar'))
+                     if speaker is None or turn.speaker == speaker]
+            stage.add(bytes=os.path.getsize(transcript))
 
-        # Creating a list of sentences
-        sentences = text.split('.')
+        return self._turn_results(turns, stopfile)
+
+    def _open(self, filename, delimiter='user avatar', **kwargs):
+        """
+        Open a transcript once it passes the pre-flight checks, including a header of a speaker
+        line and a HH:MM:SS timestamp
+        :param filename: str name of the transcript being read
+        :param delimiter: str; what separates speakers
+        :param kwargs: other keyword arguments of the default parser
+        :return: the open text file (raises InvalidFile if the file should be skipped)
+        """
+        return open_document(filename, zoom=True, delimiter=delimiter)
 
-        # removes all punctuation except apostrophes (for clarity with contractions)
-        punc = '''!()-[]{};:"\,<>./?@#$%^&*_~'''
-        text = text.translate(str.maketrans('', '', punc))
+    def _turn_results(self, turns, stopfile=None):
+        """
+        Computes the text statistics of a document made of speaker turns, plus one array entry per turn:
+        start and end time (seconds, NaN if unknown), number of words and net sentiment
+        :param turns: list of (Turn, end) making up the document
+        :param stopfile: file to remove stop words by
+        :return: results dict
+        """
+        results = self._text_results(' '.join(turn.text for turn, _ in turns), stopfile)
 
-        # list of words
-        words = text.split()
+        with self._stage('turns'):
+            results['turn_start'] = np.array([np.nan if turn.start is None else turn.start for turn, _ in turns],
+                                             dtype=np.float64)
+            results['turn_end'] = np.array([np.nan if end is None else end for _, end in turns], dtype=np.float64)
+            results['turn_words'] = np.array([len(turn.text.translate(PUNCTUATION).split()) for turn, _ in turns],
+                                             dtype=np.int32)
 
-        # delete stopwords
-        words = self.del_stopwords(words, self.load_stop_words(stopfile))
+            # turn boundaries in the token positions of the sentiment profile (text split on periods and spaces),
+            # so each turn's sentiment comes from the sentence scores without running VADER again
+            tokens = [len(turn.text.replace('.', ' ').split()) for turn, _ in turns]
+            bounds = np.concatenate([[0], np.cumsum(tokens)])
+            results['turn_sentiment'] = results['sentiment_profile'].spans(bounds).astype(np.float32)
 
-        results = {
-            'plain_text': text,
-            'wordcount': Counter(words),
-            'numwords': len(words),
-            'sentiment': SentimentIntensityAnalyzer().polarity_scores(text),
-            'sentence_length': self.sen_len(sentences)
-        }
         return results
 
+    def _stream_turns(self, transcript, group, stopfile=None, delimiter='user avatar', keys=()):
+        """
+        Stream a transcript into documents made of turns, holding only running statistics
+        :param transcript: str name of the transcript being read
+        :param group: function of a speaker returning the document their turns belong to (None to skip them)
+        :param stopfile: file to remove stop words by
+        :param delimiter: str; what separates speakers
+        :param keys: documents to return even if they have no turns
+        :return: dict {document: (results dict, talk statistics)}, in order of first appearance
+        """
+        tokenizer = get_tokenizer(stopfile)
+        streams = {key: TurnStream(tokenizer) for key in keys}
+        starts, current = [], None
+
+        with self._open(transcript, delimiter) as f, self._stage('stream') as stage:
+            for kind, value in self.turn_events(f, delimiter):
+                if kind == 'speaker':
+                    starts.append(None)
+                    key = group(value)
+                    current = None
+                    if key is not None:
+                        current = streams.setdefault(key, TurnStream(tokenizer))
+                        current.start_turn(len(starts) - 1)
+                elif kind == 'time':
+                    starts[-1] = value
+                elif kind == 'text' and current is not None:
+                    current.line(value)
+
+            results = {key: stream.close(starts) for key, stream in streams.items()}
+            stage.add(bytes=os.path.getsize(transcript),
+                      tokens=sum(stream.text.numtokens for stream in streams.values()))
+
+        return results
+
+    def _speaker_parser(self, transcript, speakers=None, stopfile=None, delimiter='user avatar', stream=False):
+        """
+        Reads a transcript once and splits it into one result dictionary per speaker
+        :param transcript: str name of the transcript being read
+        :param speakers: list of speakers to keep (default every speaker in the meeting)
+        :param stopfile: file to remove stop words by
+        :param delimiter: str; what separates speakers
+        :param stream: bool; process the transcript line by line (the plain text and the sentence lengths
+                       are not kept)
+        :return: dict {speaker: results dict}, in order of first appearance
+        """
+        if speakers is not None:
+            speakers = {speaker.strip().lower() for speaker in speakers}
+
+        if stream:
+            by_speaker = self._stream_turns(transcript, lambda name: name if speakers is None or name in speakers
+                                            else None, stopfile, delimiter)
+            return {speaker: dict(results, talk=talk) for speaker, (results, talk) in by_speaker.items()}
+
+        by_speaker, talk = {}, {}
+
+        # group the turns by speaker while walking the file
+        with self._open(transcript, delimiter) as f, self._stage('read') as stage:
+            stage.add(bytes=os.path.getsize(transcript))
+            for turn, end in self.timed_turns(f, delimiter):
+                if speakers is not None and turn.speaker not in speakers:
+                    continue
+
+                if turn.speaker not in by_speaker:
+                    by_speaker[turn.speaker] = []
+                    talk[turn.speaker] = {'words': 0, 'turns': 0, 'speaking_time': 0}
+
+                # a turn lasts until the next turn starts, whoever is speaking
+                by_speaker[turn.speaker].append((turn, end))
+                talk[turn.speaker]['words'] += len(turn.text.split())
+                talk[turn.speaker]['turns'] += 1
+                if turn.start is not None and end is not None:
+                    talk[turn.speaker]['speaking_time'] += end - turn.start
+
+        results = {}
+        for speaker, turns in by_speaker.items():
+            results[speaker] = self._turn_results(turns, stopfile)
+            results[speaker]['talk'] = talk[speaker]
+        return results
+
+    def load_speakers(self, transcript, label=None, speakers=None, stopfile=None, delimiter='user avatar',
+                      stream=False):
+        """
+        Register every speaker of a transcript (or a chosen subset) as its own document,
+        reading the file only once. Documents are labeled '<label>: <speaker>'
+        :param transcript: str name of the transcript being read
+        :param label: label for the meeting if user wants it to be anything other than file name (str)
+        :param speakers: list of speakers to keep (default every speaker in the meeting)
+        :param stopfile: file to remove stop words by
+        :param delimiter: str; what separates speakers
+        :param stream: bool; process the transcript line by line so memory does not grow with the file
+        :return: list of the labels that were added
+        """
+        if label is None:
+            label = transcript
+
+        key = self._cache_key(transcript, mode='speakers', stopfile=stopfile, delimiter=delimiter,
+                              speakers=sorted(speakers) if speakers is not None else None, stream=stream)
+        with self._stage('cache'):
+            by_speaker = self.cache.get(key) if key else None
+
+        if by_speaker is None:
+            by_speaker = self._speaker_parser(transcript, speakers, stopfile, delimiter, stream)
+            if key:
+                with self._stage('cache'):
+                    self.cache.put(key, by_speaker)
+
+        labels = []
+        with self._stage('store'):
+            for speaker, results in by_speaker.items():
+                results['talk'] = dict(results['talk'], meeting=label, speaker=speaker)
+                labels.append(f'{label}: {speaker}')
+                self._save_results(labels[-1], results)
+
+        return labels
+
+    def talk_share(self):
+        """
+        Tabulate how much each speaker talked in each meeting loaded with load_speakers
+        :return: DataFrame with one row per meeting and speaker: words, turns, speaking time (seconds)
+                 and each as a share of the meeting total
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(list(self.data['talk'].values()),
+                          columns=['meeting', 'speaker', 'words', 'turns', 'speaking_time'])
+
+        for col in ['words', 'turns', 'speaking_time']:
+            total = df.groupby('meeting')[col].transform('sum')
+            df[col + '_share'] = (df[col] / total.where(total > 0)).fillna(0)
+
+        return df
+
+    def _keyness_groups(self, groups, labels):
+        """
+        Also accepts groups='meeting' or 'speaker' to pool the documents added by load_speakers
+        (documents without speaker data are their own group)
+        """
+        if groups in ('meeting', 'speaker'):
+            talk = self.data['talk']
+            return [talk[label][groups] if label in talk else label for label in labels]
+        return super()._keyness_groups(groups, labels)
+
+    def _turn_arrays(self, labels=None):
+        """
+        Concatenate the per-turn arrays of every document that has them
+        :param labels: list of documents (default every document with turn data)
+        :return: (labels, doc index of each turn, start, end, words, sentiment arrays)
+        """
+        if labels is None:
+            labels = list(self.data['turn_start'])
+
+        lengths = [len(self.data['turn_start'][label]) for label in labels]
+        doc = np.repeat(np.arange(len(labels)), lengths)
+
+        def column(stat, dtype):
+            return (np.concatenate([self.data[stat][label] for label in labels]).astype(dtype)
+                    if labels else np.zeros(0, dtype))
+
+        return (labels, doc, column('turn_start', np.float64), column('turn_end', np.float64),
+                column('turn_words', np.float64), column('turn_sentiment', np.float64))
+
+    def timing_stats(self, labels=None):
+        """
+        Speaking time, words per minute and pauses of each document, computed over all turns at once
+        :param labels: list of documents (default every document with turn data)
+        :return: DataFrame with one row per document: turns, words, speaking_time (seconds), words_per_minute,
+                 first_start, last_end, median_pause and mean_pause (seconds between the document's turns)
+        """
+        import pandas as pd
+
+        labels, doc, start, end, words, _ = self._turn_arrays(labels)
+        n = len(labels)
+
+        # only turns with a known start and end count towards speaking time and speaking rate
+        duration = end - start
+        timed = ~np.isnan(duration)
+        speaking_time = np.bincount(doc[timed], weights=duration[timed], minlength=n)
+        timed_words = np.bincount(doc[timed], weights=words[timed], minlength=n)
+
+        pause = self.pauses(labels)
+        grouped = pause.groupby('label', sort=False)['pause']
+
+        df = pd.DataFrame({
+            'turns': np.bincount(doc, minlength=n),
+            'words': np.bincount(doc, weights=words, minlength=n).astype(np.int64),
+            'speaking_time': speaking_time,
+            'words_per_minute': np.divide(timed_words * 60, speaking_time, out=np.full(n, np.nan),
+                                          where=speaking_time > 0),
+            'first_start': [np.nanmin(self.data['turn_start'][label], initial=np.inf) for label in labels],
+            'last_end': [np.nanmax(self.data['turn_end'][label], initial=-np.inf) for label in labels]
+        }, index=pd.Index(labels, name='label'))
+
+        df[['first_start', 'last_end']] = df[['first_start', 'last_end']].replace([np.inf, -np.inf], np.nan)
+        df['median_pause'] = grouped.median()
+        df['mean_pause'] = grouped.mean()
+        return df
+
+    def pauses(self, labels=None):
+        """
+        Time between the end of each turn and the start of the document's next turn
+        (for a single speaker, how long others talked or nobody did)
+        :param labels: list of documents (default every document with turn data)
+        :return: DataFrame with columns label and pause (seconds), one row per pair of consecutive turns
+        """
+        import pandas as pd
+
+        labels, doc, start, end, _, _ = self._turn_arrays(labels)
+
+        # consecutive turns of the same document with known times
+        same = doc[1:] == doc[:-1]
+        gap = start[1:] - end[:-1]
+        keep = same & ~np.isnan(gap)
+
+        return pd.DataFrame({'label': np.asarray(labels, dtype=object)[doc[1:][keep]], 'pause': gap[keep]})
+
+    def sentiment_windows(self, window=300, labels=None):
+        """
+        Net sentiment over fixed wall-clock windows: the word-weighted average of the turns starting in each window
+        :param window: float; window length in seconds
+        :param labels: list of documents (default every document with turn data)
+        :return: DataFrame with one row per document and one column per window start (seconds);
+                 NaN where the document has no speech in a window
+        """
+        import pandas as pd
+
+        labels, doc, start, _, words, sentiment = self._turn_arrays(labels)
+        known = ~np.isnan(start)
+        doc, start, words, sentiment = doc[known], start[known], words[known], sentiment[known]
+
+        # one bin per (document, window) pair
+        n_windows = int(start.max() // window) + 1 if len(start) else 0
+        key = doc * n_windows + (start // window).astype(np.int64)
+        size = len(labels) * n_windows
+
+        weighted = np.bincount(key, weights=sentiment * words, minlength=size)
+        total = np.bincount(key, weights=words, minlength=size)
+        scores = np.divide(weighted, total, out=np.full(size, np.nan), where=total > 0)
+
+        return pd.DataFrame(scores.reshape(len(labels), n_windows), index=pd.Index(labels, name='label'),
+                            columns=np.arange(n_windows) * window)
+
     def load_text(self, transcript, label=None, parser=None, **kwargs):
         """ inherited load_text method """
         super().load_text(transcript, label, parser, **kwargs)
@@ -0,0 +1,145 @@
+"""
+validation.py: pre-flight checks of the files given to the parsers
+
+The cheap checks come first: the file's stat tells whether it exists, is a non-empty regular file
+with a known extension, without reading it. The header (encoding, and the "speaker / HH:MM:SS"
+layout of a Zoom transcript) is then sniffed from the read buffer of the very file handle the parser
+goes on to read, so a document is only read once.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import codecs
+import os
+import re
+import stat
+from exception import InvalidFile
+
+EXTENSIONS = ('.txt',)
+
+# bytes of the header that are sniffed (at most what the file handle buffers on its first read)
+HEADER_SIZE = 4096
+
+TIMESTAMP = re.compile(r'^\d{1,2}:\d{2}:\d{2}$')
+
+# one file left out of a batch: the check it failed ('missing', 'type', 'extension', 'empty', 'size',
+# 'encoding', 'format', or 'parse' for an error raised while parsing) and why
+Skipped = namedtuple('Skipped', ['filename', 'check', 'reason'])
+
+
+def check_file(filename, extensions=EXTENSIONS, max_size=None):
+    """
+    Checks that need no read: the file exists, is a regular file with a known extension and is not empty
+    :param filename: str; name of the file
+    :param extensions: tuple of accepted extensions (None to accept any)
+    :param max_size: int; largest accepted size in bytes (default no limit)
+    :return: int; size of the file in bytes
+    """
+    try:
+        info = os.stat(filename)
+    except OSError as e:
+        raise InvalidFile(filename, 'missing', e.strerror or str(e))
+
+    if not stat.S_ISREG(info.st_mode):
+        raise InvalidFile(filename, 'type', 'not a regular file')
+    if extensions and not filename.lower().endswith(tuple(extensions)):
+        raise InvalidFile(filename, 'extension', f'need a {" or ".join(extensions)} file to run the parser')
+    if info.st_size == 0:
+        raise InvalidFile(filename, 'empty', 'file is empty')
+    if max_size is not None and info.st_size > max_size:
+        raise InvalidFile(filename, 'size', f'file is larger than {max_size} bytes')
+
+    return info.st_size
+
+
+def sniff(filename, head, complete, encoding, zoom=False, delimiter='user avatar'):
+    """
+    Checks of the start of a file
+    :param filename: str; name of the file (for the error)
+    :param head: bytes; start of the file
+    :param complete: bool; whether head is the whole file
+    :param encoding: str; encoding the file is read with
+    :param zoom: bool; also require the speaker line and HH:MM:SS timestamp of a Zoom transcript
+    :param delimiter: str; (zoom) line that separates speakers
+    :return: none
+    """
+    if b'\x00' in head:
+        raise InvalidFile(filename, 'encoding', 'binary file')
+
+    # an incomplete character at the end of the head is not an error
+    try:
+        text = codecs.getincrementaldecoder(encoding)().decode(head, final=complete)
+    except UnicodeDecodeError as e:
+        raise InvalidFile(filename, 'encoding', f'not {encoding} text ({e.reason} at byte {e.start})')
+
+    if zoom:
+        lines = text.splitlines()
+        if not complete:
+            # the last line may be cut off
+            lines = lines[:-1]
+        delimiter = delimiter.lower()
+        lines = [line for line in (line.strip().lower() for line in lines) if line and line != delimiter]
+
+        if len(lines) < 2 or not TIMESTAMP.match(lines[1]):
+            raise InvalidFile(filename, 'format', 'does not start with a speaker and a HH:MM:SS timestamp')
+
+
+def open_document(filename, zoom=False, delimiter='user avatar', extensions=EXTENSIONS, max_size=None):
+    """
+    Open a file for parsing once it passes the pre-flight checks. The header is sniffed with a peek
+    at the handle's buffer, which the parser's reads then start from
+    :param filename: str; name of the file
+    :param zoom: bool; the file must be a Zoom transcript
+    :param delimiter: str; (zoom) line that separates speakers
+    :param extensions: tuple of accepted extensions (None to accept any)
+    :param max_size: int; largest accepted size in bytes (default no limit)
+    :return: the open text file
+    """
+    size = check_file(filename, extensions, max_size)
+
+    f = open(filename)
+    try:
+        head = f.buffer.peek(HEADER_SIZE)[:HEADER_SIZE]
+        sniff(filename, head, len(head) >= size, f.encoding, zoom, delimiter)
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+def skip_report(errors):
+    """
+    :param errors: dict {filename: exception} of the files that could not be loaded
+    :return: list of Skipped, in the order of the errors
+    """
+    report = []
+    for filename, error in errors.items():
+        if isinstance(error, InvalidFile):
+            report.append(Skipped(filename, error.check, error.reason))
+        else:
+            report.append(Skipped(filename, 'parse', str(error) or type(error).__name__))
+    return report
+
+
+def preflight(filenames, check, workers=None):
+    """
+    Run the pre-flight checks of a batch of files in parallel (they mostly wait on the file system,
+    so threads are enough)
+    :param filenames: list of file names
+    :param check: function of a file name raising InvalidFile if the file should be skipped
+    :param workers: int; number of threads (default: as many as the executor picks)
+    :return: (list of the files that passed, list of Skipped for the others)
+    """
+    def outcome(filename):
+        try:
+            check(filename)
+        except InvalidFile as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(outcome, filenames))
+
+    passed = [filename for filename, error in zip(filenames, outcomes) if error is None]
+    skipped = skip_report({filename: error for filename, error in zip(filenames, outcomes) if error is not None})
+    return passed, skipped
@@ -14,56 +14,344 @@ After Code
 """
 
 from collections import defaultdict, Counter
-import plotly.graph_objects as go
-import plotly.express as px
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import glob
+import hashlib
+import json
+import os
 import math
-from nltk.sentiment import SentimentIntensityAnalyzer
-from nltk.corpus import stopwords as sw
-from sankey import make_sankey as make
-import pandas as pd
-from plotly.subplots import make_subplots
-from exception import WordieError
+import pickle
+from exception import InvalidFile
+from cache import ParseCache, file_digest
+from sentiment import ProfileStream, get_engine
+from corpus import CorpusIndex, DocTermMatrix, WordcountView
+from ngrams import NGRAM_SIZES, PhraseIndex, ngram_counts
+from search import PositionalIndex
+from records import DataView, DocumentRecord
+from tokenizer import PUNCTUATION, get_tokenizer, read_stop_words
+from validation import check_file, open_document, preflight
+from profiling import Profiler, NULL_STAGE, profiled
+import numpy as np
+
+# plotly, pandas and the nltk corpora are slow to import, so the methods that need them
+# import them on first use; loading and counting words never pays for the plotting stack
+
+# bump whenever the default parsers change what they return, so cached results are not reused
+PARSER_VERSION = 9
+
+# phrases of each length a streamed document keeps when it prunes its counts
+PHRASE_CAPACITY = 2000
+
+
+def _parse_worker(cls, filename, parser=None, kwargs=None, memory=None):
+    """
+    Parse a single file inside a worker process
+    :param cls: Wordie class (or subclass) whose default parser should be used
+    :param filename: str; name of the file being read
+    :param parser: optional user-specified parser (must be picklable)
+    :param kwargs: dict; keyword arguments for the default parser
+    :param memory: None to skip profiling, otherwise whether to profile peak memory too
+    :return: (results dict, profiler records or None)
+    """
+    if parser is not None:
+        return parser(filename), None
+
+    wordie = cls(profiler=Profiler(memory=memory) if memory is not None else None)
+    results = wordie._default_parser(filename, **(kwargs or {}))
+    return results, wordie.profiler.records if wordie.profiler else None
+
+
+class TextStream:
+    """
+    Statistics of a lowercased text fed in pieces of any size. Only the unfinished word and sentence, running
+    sums and bounded counts are held between pieces, so memory does not grow with the text. The results are
+    those of Wordie._text_results on the whole text, without the plain text itself and the sentence lengths
+    (the histogram is kept), except for very long texts: each phrase length keeps the `capacity` most frequent
+    phrases once it holds twice as many (counts of phrases dropped and seen again start over), and the
+    sentiment profile merges neighbouring sentences (see ProfileStream)
+    """
+
+    def __init__(self, tokenizer, sizes=NGRAM_SIZES, capacity=PHRASE_CAPACITY):
+        """
+        :param tokenizer: Tokenizer removing the stop words
+        :param sizes: phrase lengths to count
+        :param capacity: int; phrases of each length kept when their counts are pruned
+        """
+        self.tokenizer = tokenizer
+        self.sizes = sizes
+        self.capacity = capacity
+        self.word = ''
+        self.sentence = []
+
+        self.wordcount = Counter()
+        self.numwords = 0
+        self.numtokens = 0
+        self.phrases = {n: Counter() for n in sizes}
+
+        # the last words seen, for phrases that continue into the next piece
+        self.tail = []
+        self.overlap = max(sizes, default=1) - 1
+
+        # sentence scores go into a bounded profile, and their lengths into a running histogram;
+        # the document sentiment is summed word by word
+        self.profile = ProfileStream()
+        self.sentence_hist = []
+        self.polarity = get_engine().polarity_stream()
+
+    def feed(self, text):
+        """
+        Add the next piece of the text
+        :param text: str; lowercased text
+        :return: none
+        """
+        # a word cut off at the end of the piece waits for the rest of it
+        stripped = self.word + text.translate(PUNCTUATION)
+        words = stripped.split()
+        self.word = words.pop() if words and not stripped[-1].isspace() else ''
+        self._words(words)
+
+        # likewise for the sentence after the last period
+        sentences = text.split('.')
+        if len(sentences) > 1:
+            self.sentence.append(sentences[0])
+            self._sentence(''.join(self.sentence))
+            for sentence in sentences[1:-1]:
+                self._sentence(sentence)
+            self.sentence = []
+        if sentences[-1]:
+            self.sentence.append(sentences[-1])
+
+    def _words(self, words):
+        """ count finished words """
+        self.numtokens += len(words)
+        self.polarity.feed(words)
+        words, counts = self.tokenizer.filter(words)
+        self.wordcount.update(counts)
+        self.numwords += len(words)
+
+        # phrases may start in the words kept from the previous piece
+        joined = self.tail + words
+        for n in self.sizes:
+            start = max(len(self.tail) - (n - 1), 0)
+            counts = self.phrases[n]
+            counts.update(map(' '.join, zip(*[joined[start + i:] for i in range(n)])))
+            if len(counts) > 2 * self.capacity:
+                self.phrases[n] = Counter(dict(counts.most_common(self.capacity)))
+        self.tail = joined[max(len(joined) - self.overlap, 0):] if self.overlap else []
+
+    def _sentence(self, sentence):
+        """ score and measure a finished sentence """
+        length = len(sentence.split(' '))
+        if length >= len(self.sentence_hist):
+            self.sentence_hist.extend([0] * (length + 1 - len(self.sentence_hist)))
+        self.sentence_hist[length] += 1
+
+        self.profile.add(*get_engine().score(sentence))
+
+    def close(self):
+        """
+        Finish the text
+        :return: results dict (as from Wordie._text_results, without plain_text and sentence_length)
+        """
+        if self.word:
+            self._words([self.word])
+            self.word = ''
+        self._sentence(''.join(self.sentence))
+        self.sentence = []
+
+        sentence_hist = np.array(self.sentence_hist, dtype=np.int32)
+        return {
+            'wordcount': self.wordcount,
+            'numwords': self.numwords,
+            'phrases': self.phrases,
+            'sentiment': self.polarity.close(),
+            'sentiment_profile': self.profile.profile(),
+            'sentence_hist': sentence_hist,
+            'sentence_stats': Wordie.hist_stats(sentence_hist)
+        }
 
 
 class Wordie:
 
-    def __init__(self):
-        self.data = defaultdict(dict)
+    def __init__(self, cache=None, backend='dict', profiler=None, phrases='exact', keep=None):
+        """
+        :param cache: optional ParseCache (or a directory for one) that default parser results are stored in
+        :param backend: str; 'dict' keeps a Counter per document, 'sparse' stores word counts
+                        in a shared vocabulary and sparse document-term matrix (needs scipy)
+        :param profiler: optional Profiler (or True for a new one) recording each stage of loading and charting
+        :param phrases: str or PhraseIndex; 'exact' counts every phrase, 'approx' keeps corpus-wide
+                        phrase counts in bounded memory (count-min sketches)
+        :param keep: optional list of the statistics to keep for each document, e.g. ['numwords', 'sentiment',
+                     'sentence_hist'] (default all); word counts are always kept, as is the sentiment profile
+                     of documents that keep 'sentiment' (the sentiment chart needs it); documents are only
+                     searchable if 'plain_text' is kept and only count towards the corpus phrase totals
+                     if 'phrases' is kept
+        """
+        if backend not in ('dict', 'sparse'):
+            raise ValueError(f'unknown backend {backend!r}')
+
+        # one DocumentRecord per label; data[stat][label] reads and writes the records
+        self.records = {}
+        self.keep = None
+        if keep is not None:
+            self.keep = frozenset(keep) | {'wordcount'}
+            if 'sentiment' in self.keep:
+                self.keep |= {'sentiment_profile'}
+        self.cache = ParseCache(cache) if isinstance(cache, str) else cache
+        self.backend = backend
+        self.profiler = Profiler() if profiler is True else profiler
+        self.phrases = PhraseIndex(phrases) if isinstance(phrases, str) else phrases
+
+        # token positions of every document, for keyword-in-context search
+        self.postings = PositionalIndex()
+
+        # corpus-wide word counts, kept in step with data['wordcount']
+        if backend == 'sparse':
+            self.index = DocTermMatrix()
+            self.data = DataView(self.records, {'wordcount': self.index.view()})
+        else:
+            self.index = CorpusIndex()
+            self.data = DataView(self.records)
+
+    def __getattr__(self, name):
+        # the phrase and search indexes of a reopened snapshot are rebuilt the first time they are used
+        deferred = self.__dict__.get('_deferred')
+        if deferred and name in deferred:
+            value = deferred.pop(name)()
+            setattr(self, name, value)
+            return value
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def save(self, path):
+        """
+        Save the corpus (labels, word counts and every kept statistic) to a snapshot directory
+        :param path: str; directory to write
+        :return: none
+        """
+        from snapshot import save_snapshot
+        with self._stage('save'):
+            save_snapshot(self, path)
 
-    def _default_parser(self, filename, stopfile=None):
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Reopen a saved corpus without re-parsing; fields are memory-mapped and read on first use
+        :param path: str; directory written by save
+        :param kwargs: other arguments for the constructor (e.g. cache, profiler)
+        :return: new object of this class
+        """
+        from snapshot import load_snapshot
+        return load_snapshot(cls, path, **kwargs)
+
+    def _default_parser(self, filename, stopfile=None, stream=False, chunk_size=1 << 20):
         """
         Takes in user inputted file, reads and cleans text into the result dictionary
         :param filename: str name of the file being read
         :param reader: alternative file format reader
         :param stopfile: file to remove stop words by
+        :param stream: bool; read the file in chunks so memory does not grow with the file
+                       (the results are the same, but the plain text and the document sentiment are not kept)
+        :param chunk_size: int; (stream) number of characters read at a time
         :return: results dict
         """
-        # Exception handling for the file
-        exception_handle = WordieError()
-        exception_handle.verify_text(filename=filename)
+        # pre-flight checks; the header is sniffed from the same read as the text
+        with self._open(filename) as f:
+            if stream:
+                return self._stream_results(f, stopfile, chunk_size)
 
-        # read text; lower, remove punctuation
-        text = open(filename).read().lower()
+            # read text; lower, remove punctuation
+            with self._stage('read') as stage:
+                text = f.read().lower()
+                stage.add(bytes=os.fstat(f.fileno()).st_size)
 
-        # Creating a list of sentences
-        sentences = text.split('.')
+        return self._text_results(text, stopfile)
 
-        # removes all punctuation except apostrophes (for clarity with contractions)
-        punc = '''!()-[]{};:"\,<>./?@#$%^&*_~'''
-        text = text.translate(str.maketrans('', '', punc))
+    def _open(self, filename, **kwargs):
+        """
+        Open a document for the default parser once it passes the pre-flight checks
+        :param filename: str name of the file being read
+        :param kwargs: keyword arguments of the default parser
+        :return: the open text file (raises InvalidFile if the file should be skipped)
+        """
+        return open_document(filename)
 
-        # list of words
-        words = text.split()
+    def _stream_results(self, f, stopfile=None, chunk_size=1 << 20):
+        """
+        Computes the statistics of a file read in chunks
+        :param f: open text file being read
+        :param stopfile: file to remove stop words by
+        :param chunk_size: int; number of characters read at a time
+        :return: results dict (without plain_text and sentiment)
+        """
+        stream = TextStream(get_tokenizer(stopfile))
+
+        with self._stage('stream') as stage:
+            rest = ''
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                # lowercase up to the last whitespace, so a word is never lowercased in two parts
+                chunk = rest + chunk
+                cut = max(chunk.rfind(' '), chunk.rfind('\n')) + 1
+                stream.feed(chunk[:cut].lower())
+                rest = chunk[cut:]
+            stream.feed(rest.lower())
+            stage.add(bytes=os.fstat(f.fileno()).st_size)
+
+            results = stream.close()
+            stage.add(tokens=stream.numtokens)
 
-        # delete stopwords
-        words = self.del_stopwords(words, self.load_stop_words(stopfile))
+        return results
+
+    def _stage(self, name):
+        """
+        :param name: str; name of a stage of loading or charting
+        :return: context manager recording the stage in the profiler (does nothing without one)
+        """
+        return self.profiler.stage(name) if self.profiler is not None else NULL_STAGE
+
+    def _text_results(self, text, stopfile=None):
+        """
+        Cleans lowercased text and computes the statistics stored for each document
+        :param text: str; lowercased text of the document
+        :param stopfile: file to remove stop words by
+        :return: results dict
+        """
+        # the tokenizer (and its stop word set) is built once per process for each stop word list
+        tokenizer = get_tokenizer(stopfile)
+
+        # sentences, text without punctuation (except apostrophes) and its words without stop words
+        # in one pass, checking each distinct word against the stop words once
+        with self._stage('tokenize') as stage:
+            text, sentences, numtokens, words, wordcount = tokenizer.tokenize(text)
+            stage.add(tokens=numtokens)
+
+        # score every sentence once for the segment sentiment, and the whole text for the document sentiment,
+        # with the analyzer shared by the process
+        with self._stage('sentiment') as stage:
+            profile = get_engine().profile(sentences)
+            sentiment = get_engine().polarity_scores(text)
+            stage.add(tokens=profile.numtokens)
+
+        # phrases of consecutive (non stop) words
+        with self._stage('phrases') as stage:
+            phrases = ngram_counts(words)
+            stage.add(tokens=len(words))
+
+        # sentence lengths are summarized as a histogram: index = words in the sentence
+        with self._stage('sentences'):
+            sentence_length = self.sen_len(sentences)
+            sentence_hist = np.bincount(sentence_length).astype(np.int32)
 
         results = {
             'plain_text': text,
-            'wordcount': Counter(words),
+            'wordcount': wordcount,
             'numwords': len(words),
-            'sentiment': SentimentIntensityAnalyzer().polarity_scores(text),
-            'sentence_length': self.sen_len(sentences)
+            'phrases': phrases,
+            'sentiment': sentiment,
+            'sentiment_profile': profile,
+            'sentence_length': sentence_length,
+            'sentence_hist': sentence_hist,
+            'sentence_stats': self.hist_stats(sentence_hist)
         }
         return results
 
@@ -90,8 +378,61 @@ class Wordie:
         label: unique label for a text file that we parsed
         results: the data extracted from the file as a dictionary attribute-->raw data
         """
+        # a reloaded document starts from a fresh record (in the same place), so no field of the old
+        # results outlives them
+        if label in self.records:
+            self._unindex(label, keep_row='wordcount' in results and self._keeps('wordcount'))
+            self.records[label] = DocumentRecord()
+
+        if 'wordcount' in results and self.backend == 'dict':
+            self.index.add(results['wordcount'])
+
+        # the corpus phrase totals only count the documents whose phrases are kept, since removing a document
+        # takes out exactly what it added
+        if 'phrases' in results and self._keeps('phrases'):
+            results = {**results, 'phrases': self.phrases.add(results['phrases'])}
+
+        # likewise only documents that keep their text are searchable
+        if 'plain_text' in results and self._keeps('plain_text'):
+            self.postings.add(label, results['plain_text'].split(), results.get('turn_words'),
+                              results.get('turn_start'))
+
+        # in the sparse backend, data['wordcount'] writes into the document-term matrix
         for k, v in results.items():
-            self.data[k][label] = v
+            if self._keeps(k):
+                self.data[k][label] = v
+
+    def _keeps(self, stat):
+        """
+        :param stat: str; name of a statistic
+        :return: whether documents keep it
+        """
+        return self.keep is None or stat in self.keep
+
+    def remove_text(self, label):
+        """
+        Remove a document from the framework
+        :param label: label of the document to remove
+        :return: none
+        """
+        self._unindex(label)
+        self.records.pop(label, None)
+
+    def _unindex(self, label, keep_row=False):
+        """
+        Take a document out of the corpus indexes (word totals, phrase totals, postings)
+        :param label: label of the document
+        :param keep_row: bool; (sparse) leave its row in the document-term matrix, to be overwritten in place
+        :return: none
+        """
+        if label in self.data['wordcount'] and self.backend == 'dict':
+            self.index.remove(self.data['wordcount'][label])
+        if label in self.data['phrases']:
+            self.phrases.remove(self.data['phrases'][label])
+        if label in self.postings.docs:
+            self.postings.remove(label)
+        if self.backend == 'sparse' and label in self.data['wordcount'] and not keep_row:
+            del self.data['wordcount'][label]
 
     def load_text(self, filename, label=None, parser=None, *args, **kwargs):
         """
@@ -105,29 +446,171 @@ class Wordie:
         """
 
         if parser is None:  # do default parsing of standard .txt file
-            results = self._default_parser(filename, *args, **kwargs)
+            with self._stage('cache'):
+                key = self._cache_key(filename, *args, **kwargs)
+                results = self.cache.get(key) if key else None
+
+            if results is None:
+                results = self._default_parser(filename, *args, **kwargs)
+                if key:
+                    with self._stage('cache'):
+                        self.cache.put(key, results)
         else:
-            results = parser(filename)
+            with self._stage('parser'):
+                results = parser(filename)
 
         if label is None:
             label = filename
 
         # Save / integrate the data we extracted from the file
         # into the internal state of the framework
-        self._save_results(label, results)
+        with self._stage('store'):
+            self._save_results(label, results)
+
+    def _cache_key(self, filename, *args, **kwargs):
+        """
+        Build the parse cache key for a file parsed with the default parser
+        :param filename: str; name of the file being read
+        :param args: arguments for the default parser
+        :param kwargs: keyword arguments for the default parser
+        :return: str key, or None if there is no cache (or the file cannot be read)
+        """
+        if self.cache is None:
+            return None
+
+        params = {'parser': type(self).__name__, 'version': PARSER_VERSION, 'args': args, **kwargs}
+        try:
+            # a stop word file is identified by its contents, not its name
+            if kwargs.get('stopfile'):
+                params['stopfile'] = file_digest(kwargs['stopfile'])
+            return self.cache.key(filename, params)
+        except OSError:
+            # let the parser report the missing file
+            return None
+
+    @staticmethod
+    def _expand_paths(paths_or_glob):
+        """
+        Turn a directory, glob pattern or list of paths into an ordered list of files
+        :param paths_or_glob: str directory / glob pattern, or list of file names
+        :return: list of file names
+        """
+        if isinstance(paths_or_glob, str):
+            # a directory means every .txt file inside of it
+            if os.path.isdir(paths_or_glob):
+                return sorted(glob.glob(os.path.join(paths_or_glob, '*.txt')))
+
+            # a pattern with no matches is kept so the missing file is reported
+            return sorted(glob.glob(paths_or_glob)) or [paths_or_glob]
+
+        return list(paths_or_glob)
+
+    def load_texts(self, paths_or_glob, labels=None, workers=None, parser=None, **kwargs):
+        """
+        Register a batch of documents with the framework, parsing them in parallel
+        :param paths_or_glob: directory, glob pattern (str) or list of file names
+        :param labels: list of labels (same order as the files) or dict {filename: label};
+                       files without a label are labeled by file name
+        :param workers: int; number of worker processes (default: cpu count, 1 parses in-process)
+        :param parser: user-specified parser if user does not want to use default (must be picklable)
+        :param kwargs: keyword arguments passed to the default parser of every file
+        :return: dict {filename: exception} for every file that could not be parsed; files failing a pre-flight
+                 check are skipped with an InvalidFile (see validation.skip_report for a table of the reasons)
+        """
+        filenames = self._expand_paths(paths_or_glob)
+
+        # match each file with its label
+        if labels is None:
+            labels = filenames
+        elif isinstance(labels, dict):
+            labels = [labels.get(filename, filename) for filename in filenames]
+        elif len(labels) != len(filenames):
+            raise ValueError(f'got {len(labels)} labels for {len(filenames)} files')
+
+        errors = {}
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        # cheap checks first: files the default parser would reject by their stat are never sent to a worker
+        # (the header is checked by the worker, from its own read of the file)
+        outcomes = [None] * len(filenames)
+        if parser is None:
+            with self._stage('preflight'):
+                for i, filename in enumerate(filenames):
+                    try:
+                        check_file(filename)
+                    except InvalidFile as e:
+                        outcomes[i] = e
+
+        # only files missing from the parse cache need to be parsed
+        with self._stage('cache'):
+            keys = [self._cache_key(filename, **kwargs) if parser is None and outcome is None else None
+                    for filename, outcome in zip(filenames, outcomes)]
+            outcomes = [self.cache.get(key) if key else outcome for key, outcome in zip(keys, outcomes)]
+        todo = [i for i, outcome in enumerate(outcomes) if outcome is None]
+
+        # workers profile their own stages and send the totals back
+        memory = self.profiler.memory if self.profiler is not None else None
+
+        if workers <= 1 or len(todo) <= 1:
+            # parse in this process, one file at a time
+            for i in todo:
+                try:
+                    outcomes[i] = _parse_worker(type(self), filenames[i], parser, kwargs, memory)
+                except Exception as e:
+                    outcomes[i] = e
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+                futures = {i: pool.submit(_parse_worker, type(self), filenames[i], parser, kwargs, memory)
+                           for i in todo}
+
+                # collect in submission order so the merged data is deterministic
+                for i, future in futures.items():
+                    outcomes[i] = future.exception() or future.result()
+
+        for i in todo:
+            if isinstance(outcomes[i], Exception):
+                continue
+
+            outcomes[i], records = outcomes[i]
+            if records:
+                self.profiler.merge(records)
+            if keys[i]:
+                with self._stage('cache'):
+                    self.cache.put(keys[i], outcomes[i])
+
+        with self._stage('store'):
+            for filename, label, outcome in zip(filenames, labels, outcomes):
+                if isinstance(outcome, Exception):
+                    errors[filename] = outcome
+                else:
+                    self._save_results(label, outcome)
+
+        return errors
+
+    def preflight(self, paths_or_glob, workers=None, **kwargs):
+        """
+        Check a batch of files without parsing them: stat, extension, encoding and (for transcripts) layout
+        :param paths_or_glob: directory, glob pattern (str) or list of file names
+        :param workers: int; number of threads (default: as many as the executor picks)
+        :param kwargs: keyword arguments of the default parser (e.g. the transcript delimiter)
+        :return: (list of the files that would be parsed, list of Skipped(filename, check, reason) for the others)
+        """
+        def check(filename):
+            with self._open(filename, **kwargs):
+                pass
+
+        with self._stage('preflight'):
+            return preflight(self._expand_paths(paths_or_glob), check, workers)
 
     @staticmethod
     def load_stop_words(stopfile=None):
         """
         Load stop words to filter out of each file
-        :param: stopfile: optional file with stop words to use over default
+        :param: stopfile: optional file with stop words (separated by whitespace) to use over default
         :return: list of stop words to remove
         """
-        if stopfile:
-            return open(stopfile).read()
-
-        # default list
-        return sw.words('english')
+        return read_stop_words(stopfile)
 
     @staticmethod
     def filter_wordcount(dct, keys):
@@ -137,6 +620,11 @@ class Wordie:
         :param keys: keys to search for
         :return: dictionary containing only given keys {label: {key: count}}
         """
+        # sparse backend: one column slice of the document-term matrix
+        if isinstance(dct, WordcountView):
+            labels, counts = dct.matrix.filter(keys)
+            return defaultdict(dict, {label: dict(zip(keys, row)) for label, row in zip(labels, counts.tolist())})
+
         # create new wordcount dict --> {label: {counter}}
         filtered = defaultdict(dict)
 
@@ -164,7 +652,200 @@ class Wordie:
 
         return sen_lens
 
-    def wordcount_sankey(self, word_list=None, k=5):
+    @staticmethod
+    def hist_stats(hist):
+        """
+        Summary statistics of a sentence length histogram
+        :param hist: array; hist[i] is the number of sentences that are i words long
+        :return: dict with the number of sentences and the mean, median, standard deviation, min and max length
+        """
+        hist = np.asarray(hist, dtype=np.int64)
+        lengths = np.arange(len(hist))
+        count = int(hist.sum())
+        if count == 0:
+            return {'count': 0, 'mean': 0.0, 'median': 0.0, 'std': 0.0, 'min': 0, 'max': 0}
+
+        mean = float((lengths * hist).sum() / count)
+        cum = np.cumsum(hist)
+        nonzero = np.flatnonzero(hist)
+
+        # median: average of the middle one or two lengths
+        middle = np.searchsorted(cum, [(count - 1) // 2 + 1, count // 2 + 1])
+
+        return {
+            'count': count,
+            'mean': mean,
+            'median': float(middle.mean()),
+            'std': float(np.sqrt(((lengths - mean) ** 2 * hist).sum() / count)),
+            'min': int(nonzero[0]),
+            'max': int(nonzero[-1])
+        }
+
+    def _sentence_hist(self, label):
+        """
+        Sentence length histogram of a document, built once from the sentence lengths if a custom parser skipped it
+        :param label: label of the document
+        :return: array; hist[i] is the number of sentences that are i words long
+        """
+        if label not in self.data['sentence_hist']:
+            self.data['sentence_hist'][label] = np.bincount(self.data['sentence_length'][label]).astype(np.int32)
+        return self.data['sentence_hist'][label]
+
+    def _sentence_labels(self):
+        """ labels of every document with sentence length data """
+        return list(dict.fromkeys(list(self.data['sentence_hist']) + list(self.data['sentence_length'])))
+
+    def sentence_stats(self):
+        """
+        Compare sentence length statistics across documents
+        :return: DataFrame with one row per document (count, mean, median, std, min, max)
+        """
+        import pandas as pd
+
+        labels = self._sentence_labels()
+        return pd.DataFrame([self.hist_stats(self._sentence_hist(label)) for label in labels], index=labels)
+
+    def sentence_length_table(self, normalize=False):
+        """
+        Line up the sentence length histograms of every document
+        :param normalize: bool; give each length as a share of the document's sentences instead of a count
+        :return: DataFrame indexed by sentence length with one column per document
+        """
+        import pandas as pd
+
+        labels = self._sentence_labels()
+        hists = [self._sentence_hist(label) for label in labels]
+
+        # pad every histogram to the longest sentence in the corpus
+        table = np.zeros((max((len(hist) for hist in hists), default=0), len(hists)))
+        for i, hist in enumerate(hists):
+            table[:len(hist), i] = hist
+
+        if normalize:
+            totals = table.sum(axis=0)
+            table = np.divide(table, totals, out=np.zeros_like(table), where=totals > 0)
+
+        return pd.DataFrame(table, columns=labels).rename_axis('num_words')
+
+    @profiled
+    def search(self, query, context=8, limit=None):
+        """
+        Keyword-in-context search for a word or phrase across every document
+        :param query: str; word or phrase (matched on cleaned words, stop words included)
+        :param context: int; words of context on each side of a match
+        :param limit: int; largest number of matches to return (default all)
+        :return: list of Hit(label, position, turn, time, snippet); turn and time are None for plain text files
+        """
+        return self.postings.phrase(query.lower().translate(PUNCTUATION).split(), context,
+                                    self.data['plain_text'], limit)
+
+    @profiled
+    def search_near(self, first, second, window=10, context=8, limit=None):
+        """
+        Find the places where two words or phrases are used close together
+        :param first: str; word or phrase
+        :param second: str; word or phrase
+        :param window: int; largest distance in words between the two
+        :param context: int; words of context on each side of a match
+        :param limit: int; largest number of matches to return (default all)
+        :return: list of Hit(label, position, turn, time, snippet)
+        """
+        return self.postings.near(first.lower().translate(PUNCTUATION).split(),
+                                  second.lower().translate(PUNCTUATION).split(), window, context,
+                                  self.data['plain_text'], limit)
+
+    @profiled
+    def similarity(self, labels=None, weighting='tfidf'):
+        """
+        Cosine similarity of the word counts of every pair of documents
+        :param labels: list of documents to compare (default all)
+        :param weighting: str; 'tfidf' weights words by how few documents use them, 'count' uses raw counts
+        :return: DataFrame (documents x documents) of similarities between 0 and 1
+        """
+        import pandas as pd
+        from similarity import count_matrix, cosine_similarity
+
+        if self.backend == 'sparse':
+            # rows of the document-term matrix, in label order
+            rows = {label: i for i, label in enumerate(self.index.labels)}
+            labels = list(rows) if labels is None else list(labels)
+            matrix = self.index.matrix()[[rows[label] for label in labels]]
+        else:
+            wordcounts = self.data['wordcount']
+            labels, _, matrix = count_matrix({label: wordcounts[label] for label in (labels or wordcounts)})
+
+        return pd.DataFrame(cosine_similarity(matrix, weighting), index=labels, columns=labels)
+
+    @profiled
+    def near_duplicates(self, threshold=0.8, n=2, num_perm=128):
+        """
+        Find near-duplicate documents (e.g. meetings recorded twice) with MinHash and locality-sensitive
+        hashing, without comparing every pair
+        :param threshold: float; smallest estimated Jaccard similarity of the documents' shingles
+        :param n: int; shingles are the document's phrases of n words (1 for single words)
+        :param num_perm: int; MinHash signature length (longer is more accurate)
+        :return: list of (label, label, estimated similarity), most similar first
+        """
+        from similarity import MinHasher, near_duplicates
+
+        hasher = MinHasher(num_perm)
+        signatures = {}
+        for label in self.data['wordcount']:
+            shingles = self.data['wordcount'][label] if n == 1 else self.data['phrases'][label][n]
+            if shingles:
+                signatures[label] = hasher.signature(shingles)
+
+        return near_duplicates(signatures, threshold)
+
+    def _keyness_groups(self, groups, labels):
+        """
+        :param groups: dict {label: group} or function of the label (documents it leaves out are their own group)
+        :param labels: list of documents
+        :return: list with the group of each document
+        """
+        lookup = groups if callable(groups) else lambda label: groups.get(label, label)
+        return [lookup(label) for label in labels]
+
+    @profiled
+    def keyness(self, groups=None, statistic='log_likelihood', k=20, min_count=1, n=1):
+        """
+        Words that are distinctive for each document (or group of documents) compared to the rest of the corpus
+        :param groups: dict {label: group} or function of the label to compare groups of documents instead
+                       (default every document on its own; ZoomTranscript also takes 'meeting' or 'speaker')
+        :param statistic: str; rank by 'log_likelihood', 'chi_square' or 'log_ratio'
+        :param k: int; number of words per group (None for every word the group uses)
+        :param min_count: int; ignore words a group uses fewer times
+        :param n: int; compare phrases of n words instead of single words
+        :return: DataFrame with one row per group and word, most distinctive first within each group
+                 (see keyness.keyness for the columns)
+        """
+        from keyness import keyness, rank
+        from similarity import count_matrix
+
+        if self.backend == 'sparse' and n == 1:
+            labels, words, matrix = self.index.labels, self.index.words, self.index.matrix()
+        else:
+            counts = self.data['wordcount'] if n == 1 else {label: phrases[n]
+                                                            for label, phrases in self.data['phrases'].items()}
+            labels, words, matrix = count_matrix(dict(counts.items()))
+
+        table = keyness(matrix, words, labels, None if groups is None else self._keyness_groups(groups, labels))
+        return rank(table, statistic, k, min_count)
+
+    def top_phrases(self, label=None, k=10, n=2):
+        """
+        Most frequent phrases of a document or of the whole corpus
+        :param label: label of the document (default the whole corpus)
+        :param k: int; number of phrases
+        :param n: int; phrase length (words)
+        :return: list of (phrase, count), most frequent first (corpus counts are estimates in approx mode)
+        """
+        if label is None:
+            return self.phrases.top_k(k, n)
+        return self.data['phrases'][label][n].most_common(k)
+
+    @profiled
+    def wordcount_sankey(self, word_list=None, k=5, show=True, n=1, by='count'):
         """
         Map each text to words using a Sankey diagram, where the thickness of the line
         is the number of times that word occurs in the text. Users can specify a particular
@@ -172,45 +853,66 @@ class Wordie:
         (excluding stop words)
         :param word_list: array; user-specified set of words to map to (default None)
         :param k: int; (if not word_list) number of words to use
-        :return: none. plots a sankey
+        :param show: bool; display the figure
+        :param n: int; map to phrases of n words instead of single words
+        :param by: str; (if not word_list) 'count' for the most common words, 'keyness' for the words
+                   most distinctive of any one text (highest log-likelihood)
+        :return: the sankey figure
         """
-        wordcounts = self.data['wordcount']
+        import pandas as pd
+        from sankey import make_sankey as make
 
-        # if not word_list, aggregate to find top over all counters
-        if word_list is None:
-            merged = Counter()
-            for label in wordcounts:
-                # add each counter
-                merged += wordcounts[label]
+        wordcounts = self.data['wordcount'] if n == 1 else {label: phrases[n]
+                                                            for label, phrases in self.data['phrases'].items()}
 
-            # sort dictionary by values and get filter for top k
-            word_list = [x[0] for x in sorted(merged.items(), key=lambda x: x[1], reverse=True)[:k]]
+        if word_list is None and by == 'keyness':
+            # words over-used by some text, strongest first
+            table = self.keyness(k=k, n=n)
+            table = table[table['log_likelihood'] > 0].sort_values('log_likelihood', ascending=False, kind='stable')
+            word_list = table['word'].drop_duplicates().head(k).tolist()
+        elif by not in ('count', 'keyness'):
+            raise ValueError(f'unknown word ranking {by!r} (choose from count, keyness)')
 
-        # get filtered dict for given words
-        counts = self.filter_wordcount(wordcounts, word_list)
+        # if not word_list, take the top k from the corpus-wide counts
+        if word_list is None:
+            top = self.index.top_k(k) if n == 1 else self.phrases.top_k(k, n)
+            word_list = [word for word, _ in top]
+
+        if self.backend == 'sparse' and n == 1:
+            # slice the word columns out of the document-term matrix and flatten them into links
+            labels, counts = self.index.filter(word_list)
+            df = pd.DataFrame({'src': np.repeat(labels, len(word_list)),
+                               'targ': np.tile(word_list, len(labels)),
+                               'vals': counts.ravel()})
+        else:
+            # get filtered dict for given words
+            counts = self.filter_wordcount(wordcounts, word_list)
 
-        # creating pd dataframe with the counts dict
-        # creating source column
-        src = list()
-        for label in counts.keys():
-            src += [label] * len(counts[label])
+            # creating pd dataframe with the counts dict
+            # creating source column
+            src = list()
+            for label in counts.keys():
+                src += [label] * len(counts[label])
 
-        # creating target column
-        targ = word_list * len(counts)
+            # creating target column
+            targ = word_list * len(counts)
 
-        # creating values column
-        vals = list()
-        for label in counts:
-            vals += counts[label].values()
+            # creating values column
+            vals = list()
+            for label in counts:
+                vals += counts[label].values()
 
-        # combining source, target and vals into dict and creating dataframe with it
-        df_dict = {'src': src, 'targ': targ, 'vals': vals}
-        df = pd.DataFrame.from_dict(df_dict)
+            # combining source, target and vals into dict and creating dataframe with it
+            df_dict = {'src': src, 'targ': targ, 'vals': vals}
+            df = pd.DataFrame.from_dict(df_dict)
 
         # Creating the sankey figure using the newly created df
-        fig = make(df, ['src', 'targ'], vals='vals', title='Word Appearances by Text', threshold=0, prep=False)
+        title = 'Word Appearances by Text' if n == 1 else 'Phrase Appearances by Text'
+        fig = make(df, ['src', 'targ'], vals='vals', title=title, threshold=0, prep=False)
 
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
     @staticmethod
     def get_score(score_dict):
@@ -221,41 +923,36 @@ class Wordie:
         """
         return score_dict['pos'] - score_dict['neg']
 
-    def sent_over_time(self, n=10):
+    @profiled
+    def sent_over_time(self, n=10, show=True):
         """
         Create horizontal bar chart based on the sentiments
         :param n: amount of segments you want in each bar
-        :return: nothing. plots a graphl
+        :param show: bool; display the figure
+        :return: the bar chart figure
         """
+        import plotly.graph_objects as go
+
         # creating a figure
         fig = go.Figure()
 
         # creating list of y labels for the horizontal bar
-        y_labels = self.data['sentiment'].keys()
+        y_labels = list(dict.fromkeys(list(self.data['sentiment_profile']) + list(self.data['plain_text'])))
 
-        # iterating through labels and getting the text file and step distance for each
+        # iterating through labels and getting the sentence scores for each
         for label in y_labels:
-            text = self.data['plain_text'][label].split()
-            step = int(self.data['numwords'][label] / n)
-
-            vals = []
-
-            # Iterating through each text file and slicing based on step size.
-            for i in range(1, n + 1):
-                # Checking that
-                if i < n:
-                    val = self.get_score(SentimentIntensityAnalyzer().polarity_scores(
-                        ' '.join(map(str, text[step * (i - 1):i * step]))
-                    ))
+            profile = self.data['sentiment_profile'].get(label)
 
-                # if there is only one step before the end, it slices using the  rest of the list to not exclude words.
-                else:
-                    val = self.get_score(SentimentIntensityAnalyzer().polarity_scores(
-                        ' '.join(map(str, text[step * (i - 1):]))
-                    ))
+            # documents from a custom parser are scored in windows of their plain text once
+            if profile is None:
+                if label not in self.data['plain_text']:
+                    # neither the profile nor the text was kept
+                    continue
+                profile = get_engine().profile_words(self.data['plain_text'][label].split())
+                self.data['sentiment_profile'][label] = profile
 
-                # adding the sentiment score to the list for that row
-                vals.append(val)
+            # net sentiment of each of the n equal segments, from the precomputed prefix sums
+            vals = profile.segments(n)
 
             # creating horizontal bar for the current label, using the vals list just created
             fig.add_trace(go.Bar(x=[100 / n] * n, y=[label] * n, orientation='h',
@@ -283,68 +980,65 @@ class Wordie:
             showlegend=False
         )
 
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def pie_chart(self, slices=20, file_num=0):
+    @profiled
+    def pie_chart(self, slices=20, file_num=0, show=True):
         """
         Creates a pie chart showing the distribution of the most common
         sentence lengths for each text
         :param slices: Number of slices on the pie chart
         :param file_num: file user want's to create pie chart from
+        :param show: bool; display the figure
         :return: A pie chart
         """
+        import pandas as pd
+        import plotly.express as px
+
         # make title for the graph
         title_str = f"Distribution of {slices} most common Sentence Lengths"
 
-        # read in the data from self
-        testing = self.data
-        x = list(testing['sentence_length'].values())
-
-        # find values based on the file number given in parameter
-        vals = x[file_num]
-
-        # create dictionary for sentence lengths
-        dct = {}
+        # find the histogram based on the file number given in parameter
+        hist = self._sentence_hist(self._sentence_labels()[file_num])
 
-        # fill up dictionary with values
-        for i in vals:
-            if i not in dct:
-                dct[i] = 1
-            if i in dct:
-                dct[i] += 1
-
-        # turn dictionary into data frame
-        sendf = pd.DataFrame(dct.items(), columns=["num_words", "num_sen"])
-
-        # sort the data frame and cut off the values that aren't in the top
+        # keep the lengths that occur, most common first, and cut off the values that aren't in the top
         # however many values that were designated by user
-        sendf.sort_values('num_sen')
-        top_df = sendf[0:slices].copy()
+        num_words = np.flatnonzero(hist)
+        num_words = num_words[np.argsort(-hist[num_words], kind='stable')][:slices]
+        top_df = pd.DataFrame({'num_words': num_words, 'num_sen': hist[num_words]})
 
         # make figure
         fig = px.pie(top_df, values='num_sen', names='num_words', title=title_str)
 
         # show figure
-        fig.show()
+        if show:
+            fig.show()
+        return fig
 
-    def subplot_bar(self, max_words=75):
+    @profiled
+    def subplot_bar(self, max_words=75, show=True):
         """
         Creates a set of subplots for the set of texts, showing the frequency of sentence lengths
         across each text
         :param max_words: optional parameter for max sentence length
+        :param show: bool; display the figure
         :return:a plotly subplot
         """
 
+        import plotly.graph_objects as go
+        from plotly.subplots import make_subplots
+
         # initialize empty list to store plot titles in
         plot_titles = []
 
         # iterate through labels then add to plot_titles list
-        for each in self.data['sentence_length']:
+        for each in self._sentence_labels():
             plot_titles.append(each)
 
-        # create list from sentence length dict
-        testing = self.data
-        x = list(testing['sentence_length'].values())
+        # create list of sentence length histograms
+        x = [self._sentence_hist(label) for label in plot_titles]
 
         # create subplot layout
         num_cols = math.ceil(len(x) / 2)
@@ -352,25 +1046,13 @@ class Wordie:
                             subplot_titles=(plot_titles))
 
         # create trace for each text
-        for i in range(len(self.data['sentence_length'])):
-            # set current values equal to the specific text we're looking at in this loop
-            vals = x[i]
-
-            # create dictionary for values
-            dct = {}
-
-            # fill up dictionary with values
-            for j in vals:
-                if j not in dct:
-                    dct[j] = 1
-                if j in dct:
-                    dct[j] += 1
-            sendf = pd.DataFrame(dct.items(), columns=["num_words", "num_sen"])
-            top_df = sendf[sendf["num_words"] < max_words].copy()
-
-            # split dictionary into lists of number of words per sentence and sentence frequency
-            x_vals = list(top_df["num_words"])
-            y_vals = list(top_df["num_sen"])
+        for i in range(len(x)):
+            # set current histogram equal to the specific text we're looking at in this loop
+            hist = x[i][:max_words]
+
+            # split histogram into lists of number of words per sentence and sentence frequency
+            x_vals = np.flatnonzero(hist)
+            y_vals = hist[x_vals]
 
             # calculate row and column position within subplot
             p = i + 1
@@ -393,4 +1075,78 @@ class Wordie:
         fig.update_yaxes(title_text="Sentence Frequency")
 
         # show plot
-        fig.show()
+        if show:
+            fig.show()
+        return fig
+
+    # document statistics each chart is drawn from, to tell whether it needs to be drawn again
+    CHART_INPUTS = {
+        'wordcount_sankey': ('wordcount', 'phrases'),
+        'sent_over_time': ('sentiment', 'sentiment_profile', 'plain_text'),
+        'pie_chart': ('sentence_hist', 'sentence_length'),
+        'subplot_bar': ('sentence_hist', 'sentence_length')
+    }
+
+    def _chart_specs(self, charts=None):
+        """
+        :param charts: dict {chart method name: dict of keyword arguments} (see figures)
+        :return: dict {figure name: (chart method name, keyword arguments, labels of the documents it shows)}
+        """
+        if charts is None:
+            charts = {'wordcount_sankey': {}, 'sent_over_time': {}, 'subplot_bar': {}}
+            specs = {f'pie_chart {label}': ('pie_chart', {'file_num': i}, [label])
+                     for i, label in enumerate(self._sentence_labels())}
+        else:
+            specs = {}
+
+        for name, kwargs in charts.items():
+            specs[name] = (name, kwargs, None)
+        return specs
+
+    def _chart_digest(self, method, kwargs, labels=None):
+        """
+        Hash of everything a chart is drawn from, computed without drawing it
+        :param method: str; chart method name
+        :param kwargs: dict; keyword arguments of the chart
+        :param labels: list of the documents the chart shows (default all)
+        :return: str; hex sha256 digest, or None if the chart's inputs are unknown
+        """
+        fields = self.CHART_INPUTS.get(method)
+        if fields is None:
+            return None
+
+        digest = hashlib.sha256(json.dumps([method, kwargs], sort_keys=True, default=str).encode())
+        for field in fields:
+            values = self.data[field]
+            for label in (values if labels is None else [label for label in labels if label in values]):
+                digest.update(pickle.dumps((field, label, values[label]), protocol=pickle.HIGHEST_PROTOCOL))
+        return digest.hexdigest()
+
+    def figures(self, charts=None):
+        """
+        Build figures without displaying them
+        :param charts: dict {chart method name: dict of keyword arguments}; default is every chart
+                       with its default arguments and one pie chart per document
+        :return: dict {figure name: figure}
+        """
+        return {name: getattr(self, method)(show=False, **kwargs)
+                for name, (method, kwargs, _) in self._chart_specs(charts).items()}
+
+    def export(self, outdir, charts=None, formats=('html', 'json'), workers=None, force=False):
+        """
+        Write figures to files instead of displaying them. Figures whose inputs have not changed
+        since they were last exported to outdir are not built again
+        :param outdir: str; output directory
+        :param charts: dict {chart method name: dict of keyword arguments} (see figures)
+        :param formats: list of file formats: 'html', 'json' and, if kaleido is installed, image formats such as 'png'
+        :param workers: int; number of worker processes writing files
+        :param force: bool; rewrite every figure
+        :return: dict {figure name: 'written' or 'unchanged'}
+        """
+        from export import export_figures
+
+        specs = self._chart_specs(charts)
+        builders = {name: partial(getattr(self, method), show=False, **kwargs)
+                    for name, (method, kwargs, _) in specs.items()}
+        digests = {name: self._chart_digest(method, kwargs, labels) for name, (method, kwargs, labels) in specs.items()}
+        return export_figures(builders, outdir, formats, workers, force, digests)